@@ -0,0 +1,428 @@
+"""
+Дозагрузка истории отчётов за период.
+
+Сначала по всем кабинетам из --client-id составляется план: список отчётов читается через API ЛК (при ошибке API -
+со страницы reports-daily) до начала периода, по каждому отчёту периода создаётся задача. Затем задачи выполняются
+с общим для всех кабинетов лимитом запросов к WB и не более --per-account одновременных скачиваний на кабинет.
+Отчёты, которые не удалось скачать через API, скачиваются браузером. Скачанные архивы загружаются в базу обычным
+путём (ReportPipeline, WebDriver.load_report_archive). Ход выполнения и оценка оставшегося времени пишутся в лог.
+
+Запуск:
+    python backfill.py --client-id <client_id> [<client_id> ...] --date-from 2024-01-01 --date-to 2024-06-30
+"""
+import os
+import time
+import logging
+import argparse
+import datetime
+import threading
+
+from typing import Type, Callable, Iterable, Iterator, Optional
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from log_api.log import logger
+from log_api.metrics import metrics
+from database.models import Market
+from database.db import DbConnection
+from database.journal import ReportJournal
+from web_driver.wd import WebDriver, get_browser_id
+from web_driver.pool import BrowserPool
+from web_driver.pipeline import ReportPipeline, PipelineError
+from web_driver.http_client import ReportHttpClient
+from main import group_markets, order_by_profile
+from config import DB_ADMIN_URL, DB_ARRIS_URL, MAX_WORKERS
+
+logging.getLogger("selenium").setLevel(logging.CRITICAL)
+
+BACKFILL_RATE = 1.0
+BACKFILL_BURST = 3
+BACKFILL_PER_ACCOUNT = 2
+BACKFILL_RETRIES = 3
+BACKFILL_BACKOFF = 5
+BACKFILL_BACKOFF_MAX = 300
+PROGRESS_INTERVAL = 30
+
+
+class TokenBucket:
+    """
+    Общий для всех потоков лимит запросов: в среднем rate в секунду, не более burst подряд.
+
+    pause(seconds) останавливает выдачу всем потокам, например по Retry-After ответа 429.
+    """
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    delay = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - max(self.updated, self.paused_until)) *
+                                      self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+class BackfillProgress:
+    """Счётчики задач дозагрузки с записью хода и оценки оставшегося времени в лог не чаще interval секунд."""
+
+    def __init__(self, interval: float = PROGRESS_INTERVAL) -> None:
+        self.interval = interval
+        self.planned = 0
+        self.loaded = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self._logged = self.started
+        self._lock = threading.Lock()
+
+    def plan(self, count: int) -> None:
+        with self._lock:
+            self.planned += count
+
+    def start(self) -> None:
+        """Начало выполнения задач: от него считается оценка оставшегося времени."""
+        with self._lock:
+            self.started = self._logged = time.monotonic()
+        self.log(force=True)
+
+    def finish(self, ok: bool, count: int = 1) -> None:
+        with self._lock:
+            if ok:
+                self.loaded += count
+            else:
+                self.failed += count
+        self.log()
+
+    def eta(self) -> Optional[datetime.timedelta]:
+        finished = self.loaded + self.failed
+        if not finished:
+            return None
+        elapsed = time.monotonic() - self.started
+        return datetime.timedelta(seconds=round(elapsed / finished * (self.planned - finished)))
+
+    def log(self, force: bool = False) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._logged < self.interval:
+                return
+            self._logged = now
+        eta = self.eta()
+        logger.info(f"Дозагрузка: загружено {self.loaded} из {self.planned}, ошибок {self.failed}, "
+                    f"осталось {eta if eta is not None else 'неизвестно'}")
+
+
+@dataclass
+class MarketPlan:
+    """Отчёты кабинета к дозагрузке, от старых к новым. api - список получен через API ЛК."""
+    market: Type[Market]
+    reports: list[tuple[str, datetime.date]]
+    api: bool
+
+
+def retry_delay(error: Exception, retry: int) -> tuple[float, bool]:
+    """Пауза перед повтором и признак ответа 429: Retry-After из ответа или экспоненциальная пауза."""
+    delay = min(BACKFILL_BACKOFF * 2 ** (retry - 1), BACKFILL_BACKOFF_MAX)
+    response = getattr(error, 'response', None)
+    if response is None or response.status_code != 429:
+        return delay, False
+    retry_after = response.headers.get('Retry-After')
+    try:
+        return float(retry_after), True
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(retry_after) - datetime.datetime.now(datetime.timezone.utc))
+                   .total_seconds()), True
+    except (TypeError, ValueError):
+        return delay, True
+
+
+def with_retries(func: Callable, bucket: TokenBucket, description: str):
+    """
+    Вызывает func до BACKFILL_RETRIES раз с экспоненциальной паузой между попытками.
+
+    На ответ 429 пауза берётся из Retry-After и останавливает общий лимит запросов для всех кабинетов.
+    """
+    for retry in range(1, BACKFILL_RETRIES + 1):
+        try:
+            return func()
+        except Exception as e:
+            if retry == BACKFILL_RETRIES:
+                raise
+            delay, throttled = retry_delay(e, retry)
+            if throttled:
+                bucket.pause(delay)
+            logger.error(f"{description} не удалось, попытка {retry} из {BACKFILL_RETRIES}, "
+                         f"повтор через {delay:.0f} с: {e}")
+            time.sleep(delay)
+
+
+def plan_reports(pages: Iterable[list[tuple[str, datetime.date]]], date_from: datetime.date,
+                 date_to: datetime.date, skip_ids: set[str]) -> list[tuple[str, datetime.date]]:
+    """Отчёты периода [date_from, date_to] без skip_ids, от старых к новым. Страницы читаются до начала периода."""
+    reports = {}
+    for page_reports in pages:
+        for report_id, date in page_reports:
+            if date_from <= date <= date_to and report_id not in skip_ids:
+                reports[report_id] = date
+        if page_reports and min(date for _, date in page_reports) < date_from:
+            break
+    return sorted(reports.items(), key=lambda report: (report[1], report[0]))
+
+
+def open_market(pool: BrowserPool, market: Type[Market]) -> WebDriver:
+    browser = pool.acquire(market)
+    browser.load_url(url=market.marketplace_info.link)
+    if not browser.is_browser_active():
+        raise Exception(f"Вход в ЛК {market.name_company} не выполнен")
+    return browser
+
+
+def plan_market(market: Type[Market], pool: BrowserPool, bucket: TokenBucket, date_from: datetime.date,
+                date_to: datetime.date, reload: bool) -> MarketPlan:
+    """Список отчётов кабинета за период: через API ЛК, а если API недоступно - со страницы отчётов."""
+    browser = open_market(pool, market)
+    skip_ids = set() if reload else browser.db_conn_arris.get_reports_id(client_id=browser.client_id)
+
+    http_client = ReportHttpClient.from_driver(browser.driver, browser.proxy, throttle=bucket.acquire)
+    try:
+        reports = with_retries(lambda: plan_reports(http_client.iter_reports(), date_from, date_to, skip_ids),
+                               bucket, f"Список отчётов {market.name_company} через API")
+        return MarketPlan(market=market, reports=reports, api=True)
+    except Exception as e:
+        logger.error(f"Список отчётов {market.name_company} через API не получен, читается со страницы: {e}")
+    finally:
+        http_client.close()
+
+    bucket.acquire()
+    if not browser.open_reports_page():
+        raise Exception(f"Таблица отчётов {market.name_company} не найдена")
+    reports = plan_reports(browser.iter_report_pages(throttle=bucket.acquire), date_from, date_to, skip_ids)
+    return MarketPlan(market=market, reports=reports, api=False)
+
+
+@contextmanager
+def group_pool(journal: ReportJournal) -> Iterator[BrowserPool]:
+    """Пул браузеров группы кабинетов на собственных соединениях с базами."""
+    db_conn_admin = DbConnection(url=DB_ADMIN_URL)
+    db_conn_arris = DbConnection(url=DB_ARRIS_URL)
+    pool = BrowserPool(user='WBReportBot', db_conn_admin=db_conn_admin, db_conn_arris=db_conn_arris,
+                       direct_download=True, journal=journal)
+    try:
+        yield pool
+    finally:
+        pool.close()
+        db_conn_admin.close()
+        db_conn_arris.close()
+
+
+def plan_group(markets: list[Type[Market]], pool: BrowserPool, bucket: TokenBucket, date_from: datetime.date,
+               date_to: datetime.date, reload: bool) -> list[MarketPlan]:
+    """
+    Планы кабинетов группы (общий телефон или прокси), последовательно.
+
+    Браузеры pool остаются открытыми для выполнения планов, поэтому вход в ЛК при выполнении не повторяется.
+    """
+    plans = []
+    for market in order_by_profile(markets):
+        try:
+            plan = plan_market(market, pool, bucket, date_from, date_to, reload)
+        except Exception as e:
+            logger.error(f"План дозагрузки {market.name_company} не составлен: {e}")
+            continue
+        logger.info(f"Дозагрузка {market.name_company}: отчётов за период {len(plan.reports)}, "
+                    f"список {'через API' if plan.api else 'со страницы'}")
+        plans.append(plan)
+    return plans
+
+
+def download_report(browser: WebDriver, http_client: ReportHttpClient, bucket: TokenBucket, report_id: str,
+                    date: datetime.date) -> Optional[str]:
+    """Скачивает архив отчёта через API в обычную папку reports/<дата>/<client_id>. None, если попытки исчерпаны."""
+    path = os.path.join(browser.reports_path, date.isoformat(), browser.client_id)
+    os.makedirs(path, exist_ok=True)
+
+    def download() -> str:
+        with metrics.stage(browser.client_id, 'download_api') as record:
+            file_path = http_client.download_report(report_id, path)
+            record.rows = 1
+            record.bytes = os.path.getsize(file_path)
+        return file_path
+
+    try:
+        file_path = with_retries(download, bucket, f"Скачивание отчёта {report_id} через API")
+    except Exception as e:
+        logger.error(f"Отчёт {report_id} через API не скачан: {e}")
+        return None
+    browser.journal.downloaded(browser.client_id, report_id, date, file_path)
+    return file_path
+
+
+def backfill_market(plan: MarketPlan, pool: BrowserPool, bucket: TokenBucket, progress: BackfillProgress,
+                    per_account: int, reload: bool) -> None:
+    """
+    Выполняет задачи кабинета: до per_account скачиваний через API одновременно, затем браузером - то, что
+    через API не скачалось или если список был получен со страницы. Архивы загружаются по мере скачивания.
+    """
+    market = plan.market
+    try:
+        browser = open_market(pool, market)
+    except Exception:
+        progress.finish(ok=False, count=len(plan.reports))
+        raise
+
+    def load(file_path: str, date: datetime.date) -> None:
+        try:
+            browser.load_report_archive(file_path, date, force=reload)
+        except Exception:
+            progress.finish(ok=False)
+            raise
+        progress.finish(ok=True)
+
+    with ReportPipeline(load=load) as pipeline:
+        to_download = []
+        for report_id, date in plan.reports:
+            browser.journal.listed(browser.client_id, report_id, date)
+            file_path = None if reload else browser.journal.is_downloaded(browser.client_id, report_id)
+            if file_path:
+                pipeline.submit(file_path, date)
+            else:
+                to_download.append((report_id, date))
+
+        browser_jobs = to_download
+        if plan.api and to_download:
+            browser_jobs = []
+            http_client = ReportHttpClient.from_driver(browser.driver, browser.proxy, workers=per_account,
+                                                       throttle=bucket.acquire)
+            try:
+                with ThreadPoolExecutor(max_workers=per_account, thread_name_prefix="Backfill") as executor:
+                    futures = {executor.submit(download_report, browser, http_client, bucket, report_id, date):
+                               (report_id, date) for report_id, date in to_download}
+                    for future in as_completed(futures):
+                        report_id, date = futures[future]
+                        try:
+                            file_path = future.result()
+                        except Exception as e:
+                            logger.error(f"Задача отчёта {report_id} {market.name_company} завершилась ошибкой: {e}")
+                            file_path = None
+                        if file_path:
+                            pipeline.submit(file_path, date)
+                        else:
+                            browser_jobs.append((report_id, date))
+            finally:
+                http_client.close()
+
+        current_date = None
+        for report_id, date in sorted(browser_jobs, key=lambda job: (job[1], job[0])):
+            try:
+                if date != current_date:
+                    browser.change_path_downloads(date=date.isoformat())
+                    current_date = date
+                bucket.acquire()
+                file_path = browser.download_report_browser(report_id, date)
+            except Exception as e:
+                logger.error(f"Отчёт {report_id} {market.name_company} браузером не скачан: {e}")
+                file_path = None
+            if file_path:
+                pipeline.submit(file_path, date)
+            else:
+                progress.finish(ok=False)
+
+
+def backfill_group(plans: list[MarketPlan], pool: BrowserPool, bucket: TokenBucket, progress: BackfillProgress,
+                   per_account: int, reload: bool) -> None:
+    """Последовательно выполняет планы кабинетов группы, закрывая браузер профиля после его последнего кабинета."""
+    for i, plan in enumerate(plans):
+        try:
+            backfill_market(plan, pool, bucket, progress, per_account, reload)
+        except PipelineError as e:
+            logger.error(f"Дозагрузка {plan.market.name_company}: {e}")
+        except Exception as e:
+            logger.error(f"Дозагрузка {plan.market.name_company} прервана: {e}")
+        if all(get_browser_id(next_plan.market) != get_browser_id(plan.market) for next_plan in plans[i + 1:]):
+            pool.release(plan.market)
+
+
+def run_groups(func: Callable, groups: list) -> list:
+    """Выполняет func для каждой группы в MAX_WORKERS потоков. Результаты групп с ошибкой пропускаются."""
+    results = []
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = [executor.submit(func, group) for group in groups]
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.error(e)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--client-id', nargs='+', required=True)
+    parser.add_argument('--date-from', type=datetime.date.fromisoformat, required=True)
+    parser.add_argument('--date-to', type=datetime.date.fromisoformat, default=datetime.date.today())
+    parser.add_argument('--rate', type=float, default=BACKFILL_RATE, help='запросов к WB в секунду на все кабинеты')
+    parser.add_argument('--per-account', type=int, default=BACKFILL_PER_ACCOUNT,
+                        help='одновременных скачиваний на кабинет')
+    parser.add_argument('--reload', action='store_true', help='перезагрузить уже загруженные отчёты')
+    args = parser.parse_args()
+
+    db_conn_admin = DbConnection(url=DB_ADMIN_URL)
+    try:
+        markets = [market for market in db_conn_admin.get_markets() if market.client_id in args.client_id]
+    finally:
+        db_conn_admin.close()
+    missing = set(args.client_id) - {market.client_id for market in markets}
+    if missing:
+        logger.error(f"Кабинеты не найдены: {', '.join(sorted(missing))}")
+
+    markets_by_id = {market.id: market for market in markets}
+    groups = [[markets_by_id[market_id] for market_id in market_ids] for market_ids in group_markets(markets)]
+    bucket = TokenBucket(rate=args.rate, burst=BACKFILL_BURST)
+    progress = BackfillProgress()
+    journal = ReportJournal()
+
+    # Все кабинеты планируются до начала скачивания, чтобы оценка оставшегося времени учитывала весь объём.
+    # Пул браузеров группы открыт в обеих фазах: браузер, вошедший в ЛК при планировании, скачивает отчёты
+    with ExitStack() as stack:
+        pools = [stack.enter_context(group_pool(journal)) for _ in groups]
+        group_plans = run_groups(lambda item: (item[1], plan_group(item[0], item[1], bucket, args.date_from,
+                                                                   args.date_to, args.reload)),
+                                 list(zip(groups, pools)))
+        for pool, plans in group_plans:
+            progress.plan(sum(len(plan.reports) for plan in plans))
+            if not plans:
+                pool.close()
+        progress.start()
+
+        run_groups(lambda item: backfill_group(item[1], item[0], bucket, progress, args.per_account, args.reload),
+                   [(pool, plans) for pool, plans in group_plans if plans])
+
+    progress.log(force=True)
+    logger.info(f"Дозагрузка завершена, отчёты по стадиям {journal.progress()}")
+    journal.close()
+    metrics.write()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Сравнение скорости загрузки отчёта в wb_report_daily: ORM-объекты против COPY/INSERT пачками.
+
+Запуск:
+    python -m benchmarks.bench_load --url postgresql+psycopg2://... --client-id <client_id> --rows 10000
+"""
+import time
+import random
+import argparse
+import datetime
+
+from typing import Optional
+from sqlalchemy import select, delete
+
+from database.db import DbConnection
+from database.models import WBReportDaily, WBTypeServices
+from database.data_classes import DataWBReportDaily
+
+REPORT_ID = 'benchmark'
+
+
+def make_rows(count: int, date: datetime.date) -> list[DataWBReportDaily]:
+    rows = []
+    for i in range(count):
+        rows.append(DataWBReportDaily(realizationreport_id=REPORT_ID, gi_id=str(i), subject_name='Футболки',
+                                      sku=str(100000 + i), brand='Brand', vendor_code=f'VC-{i}', size='M',
+                                      barcode=str(2000000000000 + i), doc_type_name='Продажа', quantity=1,
+                                      retail_price=1000.0, retail_amount=900.0, sale_percent=10,
+                                      commission_percent=15.5, office_name='Коледино',
+                                      supplier_oper_name=random.choice(('Продажа', 'Логистика', 'Возврат')),
+                                      order_date=date, sale_date=date, operation_date=date, shk_id=str(i),
+                                      retail_price_withdisc_rub=900.0, delivery_amount=0, return_amount=0,
+                                      delivery_rub=0.0, gi_box_type_name='Без коробов',
+                                      product_discount_for_report=10.0, supplier_promo=0, order_id='0',
+                                      ppvz_spp_prc=5.0, ppvz_kvw_prc_base=15.0, ppvz_kvw_prc=15.0,
+                                      sup_rating_prc_up=0.0, is_kgvp_v2=0.0, ppvz_sales_commission=135.0,
+                                      ppvz_for_pay=765.0, ppvz_reward=0.0, acquiring_fee=12.5,
+                                      acquiring_bank='Банк', ppvz_vw=110.0, ppvz_vw_nds=22.0, ppvz_office_id='0',
+                                      ppvz_office_name='ПВЗ', ppvz_supplier_id='0', ppvz_supplier_name='ИП',
+                                      ppvz_inn='0000000000', declaration_number='', bonus_type_name=None,
+                                      sticker_id='0', site_country='Россия', penalty=0.0, additional_payment=0.0,
+                                      rebill_logistic_cost=0.0, rebill_logistic_org=None, kiz=None,
+                                      storage_fee=0.0, deduction=0.0, acceptance=0.0, posting_number=f'srid-{i}'))
+    return rows
+
+
+def type_services(db_conn: DbConnection) -> set[tuple[str, Optional[str]]]:
+    """Пары (operation_type, service), уже записанные в wb_type_services."""
+    with db_conn.sessionmaker() as session:
+        return {tuple(row) for row in session.execute(select(WBTypeServices.operation_type,
+                                                             WBTypeServices.service)).all()}
+
+
+def delete_new_type_services(db_conn: DbConnection, known: set[tuple[str, Optional[str]]]) -> None:
+    """Удаляет типы услуг 'new', которых не было в known, то есть добавленные замером."""
+    with db_conn.sessionmaker() as session:
+        for operation_type, service in type_services(db_conn) - known:
+            session.execute(delete(WBTypeServices).filter(
+                WBTypeServices.operation_type == operation_type,
+                WBTypeServices.service.is_(None) if service is None else WBTypeServices.service == service,
+                WBTypeServices.type_name == 'new'))
+        session.commit()
+
+
+def run(db_conn: DbConnection, client_id: str, rows: list[DataWBReportDaily], date: datetime.date,
+        bulk: bool) -> float:
+    start = time.perf_counter()
+    db_conn.add_wb_report_daily_entry(client_id=client_id, list_report=rows, date=date,
+                                      realizationreport_id=REPORT_ID, bulk=bulk)
+    return len(rows) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', required=True)
+    parser.add_argument('--client-id', required=True)
+    parser.add_argument('--rows', type=int, default=10000)
+    args = parser.parse_args()
+
+    date = datetime.date(2000, 1, 1)
+    rows = make_rows(args.rows, date)
+    db_conn = DbConnection(url=args.url)
+    known = type_services(db_conn)
+    try:
+        for name, bulk in (('orm', False), ('bulk', True)):
+            print(f"{name:>5}: {run(db_conn, args.client_id, rows, date, bulk):>12.0f} rows/sec")
+    finally:
+        with db_conn.sessionmaker() as session:
+            session.query(WBReportDaily).filter_by(client_id=args.client_id, realizationreport_id=REPORT_ID).delete()
+            session.commit()
+        delete_new_type_services(db_conn, known)
+        db_conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Офлайн-бенчмарк горячего пути обработки отчёта: разбор архива, сопоставление типов услуг и загрузка в базу.
+
+Отчёты создаются benchmarks.generator. Без --url загрузка измеряется на SQLite в памяти,
+с --url - на указанной базе (строки отчёта REPORT_ID и добавленные замером типы услуг после замера удаляются).
+Результаты пишутся в JSON, чтобы сравнивать их между версиями.
+
+Запуск:
+    python -m benchmarks.bench_report --rows 1000 10000 100000 --output bench.json
+    python -m benchmarks.bench_report --url postgresql+psycopg2://... --client-id <client_id>
+"""
+import sys
+import json
+import time
+import argparse
+import datetime
+import platform
+import tracemalloc
+import subprocess
+
+from typing import Callable, Optional
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database.db import DbConnection
+from database.models import metadata, WBReportDaily
+from database.classifier import TypeServicesClassifier
+from database.data_classes import ReportBatch
+from web_driver.report_reader import read_report_batch, open_report_archive
+from benchmarks.bench_load import type_services as known_type_services, delete_new_type_services
+from benchmarks.generator import OPERATIONS, DEFAULT_PATH, DEFAULT_DATE, make_report_archive
+
+REPORT_ID = 'benchmark'
+CLIENT_ID = 'benchmark'
+SQLITE_TABLES = ('clients', 'wb_report_daily', 'wb_type_services')
+
+
+class SQLiteConnection(DbConnection):
+    """DbConnection поверх SQLite в памяти с таблицами, нужными для загрузки отчёта."""
+
+    def __init__(self) -> None:
+        self.engine = create_engine('sqlite://')
+        metadata.create_all(self.engine, tables=[metadata.tables[table] for table in SQLITE_TABLES])
+        self.sessionmaker = sessionmaker(self.engine, expire_on_commit=False)
+        self.reports_id: dict[str, set[str]] = {}
+
+
+def type_services() -> list[tuple[str, Optional[str]]]:
+    """Известные типы услуг: типы из генератора и столько же посторонних, как в рабочей базе."""
+    known = [item for item, _ in OPERATIONS]
+    known += [(f"Операция {i}", f"Услуга {j}") for i in range(50) for j in range(10)]
+    return known
+
+
+def measure(func: Callable, memory: bool = True) -> tuple[object, dict]:
+    """
+    Результат func, время выполнения и пик памяти.
+
+    tracemalloc замедляет разбор в несколько раз, поэтому время и память измеряются разными запусками func.
+    """
+    start = time.perf_counter()
+    result = func()
+    stats = {'seconds': time.perf_counter() - start}
+    if memory:
+        tracemalloc.start()
+        try:
+            func()
+            stats['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result, stats
+
+
+def bench_parse(zip_file_path: str, date: datetime.date, memory: bool = True) -> tuple[ReportBatch, dict]:
+    def parse() -> ReportBatch:
+        with open_report_archive(zip_file_path) as excel_file:
+            return read_report_batch(excel_file=excel_file, realizationreport_id=REPORT_ID, date=date)
+
+    batch, stats = measure(parse, memory)
+    stats['rows_per_sec'] = len(batch) / stats['seconds']
+    return batch, stats
+
+
+def bench_classify(batch: ReportBatch, memory: bool = True) -> dict:
+    def classify() -> TypeServicesClassifier:
+        classifier = TypeServicesClassifier(type_services())
+        for operation_type, service in zip(batch.column('supplier_oper_name').tolist(),
+                                           batch.column('bonus_type_name').tolist()):
+            classifier.classify(operation_type, service)
+        return classifier
+
+    classifier, stats = measure(classify, memory)
+    stats['rows_per_sec'] = len(batch) / stats['seconds']
+    stats['new_types'] = len(classifier.new_types)
+    return stats
+
+
+def bench_load(db_conn: DbConnection, client_id: str, batch: ReportBatch, date: datetime.date,
+               memory: bool = True) -> dict:
+    def load() -> None:
+        db_conn.add_wb_report_daily_entry(client_id=client_id, list_report=batch, date=date,
+                                          realizationreport_id=REPORT_ID)
+
+    known = known_type_services(db_conn)
+    try:
+        _, stats = measure(load, memory)
+    finally:
+        with db_conn.sessionmaker() as session:
+            session.query(WBReportDaily).filter_by(client_id=client_id, realizationreport_id=REPORT_ID).delete()
+            session.commit()
+        delete_new_type_services(db_conn, known)
+    stats['rows_per_sec'] = len(batch) / stats['seconds']
+    stats['driver'] = db_conn.engine.dialect.driver
+    return stats
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes: list[int], db_conn: DbConnection, client_id: str, path: str = DEFAULT_PATH,
+        date: datetime.date = DEFAULT_DATE, memory: bool = True) -> dict:
+    results = {'revision': git_revision(),
+               'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'sizes': {}}
+    for rows in sizes:
+        zip_file_path = make_report_archive(path, rows, date)
+        batch, parse = bench_parse(zip_file_path, date, memory)
+        load = bench_load(db_conn, client_id, batch, date, memory)
+        results['sizes'][str(rows)] = {'parse': parse, 'classify': bench_classify(batch, memory), 'load': load}
+        print(f"{rows:>7} строк: разбор {parse['seconds']:.2f} с, загрузка {load['seconds']:.2f} с", file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--url', help='база для замера загрузки, по умолчанию SQLite в памяти')
+    parser.add_argument('--client-id', default=CLIENT_ID, help='существующий client_id в базе --url')
+    parser.add_argument('--path', default=DEFAULT_PATH, help='папка для сгенерированных отчётов')
+    parser.add_argument('--output', help='файл для результатов, по умолчанию stdout')
+    parser.add_argument('--no-memory', action='store_true', help='не измерять пик памяти')
+    args = parser.parse_args()
+
+    db_conn = DbConnection(url=args.url) if args.url else SQLiteConnection()
+    try:
+        results = run(args.rows, db_conn, args.client_id, args.path, memory=not args.no_memory)
+    finally:
+        db_conn.close()
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Генератор синтетических ежедневных отчётов WB: zip-архив с xlsx в формате ЛК (62 столбца).
+
+Запуск:
+    python -m benchmarks.generator --rows 10000 --path reports/benchmarks
+"""
+import os
+import random
+import zipfile
+import argparse
+import datetime
+
+from openpyxl import Workbook
+
+from web_driver.report_reader import REPORT_COLUMNS_MAP, LEGACY_COLUMNS_COUNT
+
+DEFAULT_PATH = os.path.join(os.getcwd(), "reports", "benchmarks")
+DEFAULT_DATE = datetime.date(2000, 1, 1)
+
+# Обоснования для оплаты и виды логистики, штрафов и доплат в тех же пропорциях, что в реальных отчётах
+OPERATIONS = (
+    (('Продажа', None), 40),
+    (('Логистика', 'К клиенту при продаже'), 30),
+    (('Логистика', 'От клиента при возврате'), 5),
+    (('Возврат', None), 5),
+    (('Хранение', None), 8),
+    (('Штраф', 'Штраф за нарушение правил маркировки'), 2),
+    (('Удержание', None), 3),
+    (('Коррекция логистики', 'Коррекция логистики при продаже'), 2),
+    (('Платная приемка', None), 5),
+)
+
+
+def report_headers() -> list[str]:
+    """Заголовки столбцов отчёта. Столбцы, которые не разбираются, получают собственные имена."""
+    headers = [f"Столбец {position + 1}" for position in range(LEGACY_COLUMNS_COUNT)]
+    headers[0] = '№'
+    for header, position, _ in REPORT_COLUMNS_MAP.values():
+        headers[position] = header
+    return headers
+
+
+def make_row(number: int, date: datetime.date, rnd: random.Random) -> list:
+    """Одна строка отчёта в порядке столбцов report_headers."""
+    (supplier_oper_name, bonus_type_name), = rnd.choices([item for item, _ in OPERATIONS],
+                                                         weights=[weight for _, weight in OPERATIONS])
+    order_date = date - datetime.timedelta(days=rnd.randint(0, 30))
+    price = rnd.randint(300, 10000)
+    discount = rnd.randint(0, 70)
+    price_with_discount = round(price * (100 - discount) / 100, 2)
+    values = {
+        'gi_id': str(rnd.randint(10 ** 7, 10 ** 8)),
+        'subject_name': rnd.choice(('Футболки', 'Платья', 'Джинсы', 'Кроссовки')),
+        'sku': str(rnd.randint(10 ** 7, 10 ** 9)),
+        'brand': rnd.choice(('Brand', 'Другой бренд', '')),
+        'vendor_code': f"VC-{rnd.randint(1, 5000)}",
+        'size': rnd.choice(('XS', 'S', 'M', 'L', 'XL', '0')),
+        'barcode': str(2000000000000 + rnd.randint(0, 10 ** 9)),
+        'doc_type_name': 'Возврат' if supplier_oper_name == 'Возврат' else 'Продажа',
+        'supplier_oper_name': supplier_oper_name,
+        'order_date': order_date.isoformat(),
+        'sale_date': date.isoformat(),
+        'quantity': int(supplier_oper_name in ('Продажа', 'Возврат')),
+        'retail_price': price,
+        'retail_amount': price_with_discount,
+        'product_discount_for_report': discount,
+        'supplier_promo': rnd.choice(('', 0, 5)),
+        'sale_percent': discount,
+        'retail_price_withdisc_rub': price_with_discount,
+        'sup_rating_prc_up': 0,
+        'is_kgvp_v2': 0,
+        'ppvz_spp_prc': rnd.randint(0, 30),
+        'commission_percent': 15.5,
+        'ppvz_kvw_prc_base': 12.92,
+        'ppvz_kvw_prc': 12.92,
+        'ppvz_sales_commission': round(price_with_discount * 0.1292, 2),
+        'ppvz_reward': 0,
+        'acquiring_fee': round(price_with_discount * 0.015, 4),
+        'ppvz_vw': round(price_with_discount * 0.1, 2),
+        'ppvz_vw_nds': round(price_with_discount * 0.02, 2),
+        'ppvz_for_pay': round(price_with_discount * 0.85, 2),
+        'delivery_amount': int(supplier_oper_name == 'Логистика'),
+        'return_amount': int(bonus_type_name == 'От клиента при возврате'),
+        'delivery_rub': round(rnd.uniform(30, 150), 2) if supplier_oper_name == 'Логистика' else 0,
+        'penalty': 300 if supplier_oper_name == 'Штраф' else 0,
+        'additional_payment': 0,
+        'bonus_type_name': bonus_type_name or '',
+        'sticker_id': rnd.choice(('', str(rnd.randint(10 ** 9, 10 ** 10)))),
+        'acquiring_bank': rnd.choice(('Тинькофф', 'Сбербанк', '')),
+        'ppvz_office_id': str(rnd.randint(1, 300000)),
+        'ppvz_office_name': 'Москва, ул. Тверская 1',
+        'ppvz_inn': '7721546864',
+        'ppvz_supplier_name': 'ООО "Вайлдберриз"',
+        'office_name': rnd.choice(('Коледино', 'Электросталь', 'Казань', 'Тула')),
+        'site_country': 'Россия',
+        'gi_box_type_name': rnd.choice(('Без коробов', 'Короба', 'Монопаллета')),
+        'declaration_number': '',
+        'kiz': '',
+        'shk_id': str(rnd.randint(10 ** 9, 10 ** 10)),
+        'posting_number': f"{rnd.getrandbits(64):x}.0.0",
+        'rebill_logistic_cost': 0,
+        'rebill_logistic_org': '',
+        'storage_fee': round(rnd.uniform(1, 50), 2) if supplier_oper_name == 'Хранение' else 0,
+        'deduction': 100 if supplier_oper_name == 'Удержание' else 0,
+        'acceptance': 50 if supplier_oper_name == 'Платная приемка' else 0,
+    }
+    row = [''] * LEGACY_COLUMNS_COUNT
+    row[0] = number
+    for field, (_, position, _) in REPORT_COLUMNS_MAP.items():
+        row[position] = values[field]
+    return row
+
+
+def make_report_archive(path: str, rows: int, date: datetime.date = DEFAULT_DATE, seed: int = 0) -> str:
+    """
+    Создаёт архив отчёта на rows строк в папке path. Возвращает путь к архиву.
+
+    Содержимое зависит только от rows, date и seed, поэтому уже созданный архив используется повторно.
+    """
+    os.makedirs(path, exist_ok=True)
+    report_id = f"{rows}-{seed}"
+    zip_file_path = os.path.join(path, f"Ежедневный отчёт №{report_id}.zip")
+    if os.path.isfile(zip_file_path):
+        return zip_file_path
+
+    rnd = random.Random(seed)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Sheet1')
+    sheet.append(report_headers())
+    for number in range(1, rows + 1):
+        sheet.append(make_row(number, date, rnd))
+
+    xlsx_path = os.path.join(path, f"{report_id}.xlsx")
+    workbook.save(xlsx_path)
+    try:
+        with zipfile.ZipFile(zip_file_path + '.part', 'w', compression=zipfile.ZIP_DEFLATED) as zip_ref:
+            zip_ref.write(xlsx_path, arcname=f"Еженедельный детализированный отчет №{report_id}.xlsx")
+        os.replace(zip_file_path + '.part', zip_file_path)
+    finally:
+        os.remove(xlsx_path)
+    return zip_file_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--path', default=DEFAULT_PATH)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        print(make_report_archive(args.path, rows, seed=args.seed))
+
+
+if __name__ == '__main__':
+    main()
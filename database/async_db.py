@@ -0,0 +1,323 @@
+import time
+import asyncio
+import logging
+import datetime
+
+from typing import Type, Optional, Callable, Awaitable, AsyncIterator
+from functools import wraps
+from itertools import islice
+from contextlib import asynccontextmanager
+from sqlalchemy import select, delete, insert, text, func as f
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.orm import selectinload
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from log_api.metrics import metrics
+from database.models import *
+from database.classifier import TypeServicesClassifier
+from database.db import BULK_CHUNK_SIZE, PHONE_MESSAGE_POLL, PHONE_MESSAGE_TIMEOUT, REPORT_COLUMNS
+from database.data_classes import Report, iter_report_values, report_operation_types
+
+logger = logging.getLogger(__name__)
+
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'postgresql+psycopg2': 'postgresql+asyncpg',
+                 'sqlite': 'sqlite+aiosqlite', 'sqlite+pysqlite': 'sqlite+aiosqlite'}
+
+
+def async_retry_on_exception(retries=3, delay=10):
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            attempt = 0
+            while attempt < retries:
+                try:
+                    return await func(self, *args, **kwargs)
+                except DBAPIError as e:
+                    # С asyncpg обрыв соединения приходит и как InterfaceError/DBAPIError с connection_invalidated
+                    if not isinstance(e, OperationalError) and not e.connection_invalidated:
+                        logger.error(f"An unexpected error occurred: {e}. Rolling back...")
+                        raise e
+                    attempt += 1
+                    metrics.retry(func.__name__)
+                    logger.debug(f"Error occurred: {e}. Retrying {attempt}/{retries} after {delay} seconds...")
+                    await asyncio.sleep(delay)
+                except Exception as e:
+                    logger.error(f"An unexpected error occurred: {e}. Rolling back...")
+                    raise e
+            raise RuntimeError("Max retries exceeded. Operation failed.")
+
+        return wrapper
+
+    return decorator
+
+
+class AsyncDbConnection:
+    """
+    Асинхронный вариант DbConnection на asyncio (SQLAlchemy AsyncEngine, asyncpg).
+
+    Методы те же, что у DbConnection, но каждый вызов работает в собственной сессии, поэтому одно соединение
+    могут использовать параллельно задачи многих кабинетов в одном цикле событий. Ожидание кода
+    и очереди СМС не блокирует цикл событий.
+    """
+
+    def __init__(self, url: str, echo: bool = False, pool_size: int = 5, max_overflow: int = 5) -> None:
+        url = make_url(url)
+        url = url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+        connect_args = {"timeout": 10} if url.get_backend_name() == 'postgresql' else {}
+        self.engine = create_async_engine(url=url,
+                                          echo=echo,
+                                          pool_size=pool_size,
+                                          max_overflow=max_overflow,
+                                          pool_timeout=30,
+                                          pool_recycle=1800,
+                                          pool_pre_ping=True,
+                                          connect_args=connect_args)
+        self.sessionmaker = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.reports_id: dict[str, set[str]] = {}
+        self._type_services_lock = asyncio.Lock()
+
+    async def close(self) -> None:
+        await self.engine.dispose()
+
+    @async_retry_on_exception()
+    async def get_markets(self, marketplace: str = 'WB') -> list[Type[Market]]:
+        async with self.sessionmaker() as session:
+            result = await session.scalars(select(Market).filter_by(marketplace=marketplace).options(
+                selectinload(Market.marketplace_info), selectinload(Market.connect_info)))
+            return list(result.all())
+
+    @async_retry_on_exception()
+    async def get_marketplace(self, marketplace: str = 'WB') -> Type[Marketplace]:
+        async with self.sessionmaker() as session:
+            return await session.scalar(select(Marketplace).filter_by(marketplace=marketplace).limit(1))
+
+    @async_retry_on_exception()
+    async def check_user(self, login: str, password: str):
+        async with self.sessionmaker() as session:
+            user = await session.scalar(select(User).filter(f.lower(User.user) == login.lower(),
+                                                            User.password == password).limit(1))
+        if user is not None:
+            return user.group
+
+    @asynccontextmanager
+    async def phone_message_listener(self) -> AsyncIterator[Callable[[float], Awaitable[None]]]:
+        """
+        Подписка на уведомления о записи кода в phone_message (LISTEN через asyncpg).
+
+        Отдаёт корутину ожидания wait(timeout), которая завершается сразу после уведомления или по таймауту.
+        Если подписаться не удалось, wait(timeout) просто спит timeout секунд.
+        """
+        notified = asyncio.Event()
+
+        def on_notify(*_) -> None:
+            notified.set()
+
+        try:
+            connection = await self.engine.connect()
+        except Exception as e:
+            logger.debug(f"LISTEN {PHONE_MESSAGE_CHANNEL} недоступен, используется опрос: {e}")
+            yield asyncio.sleep
+            return
+
+        try:
+            raw_connection = await connection.get_raw_connection()
+            driver_connection = raw_connection.driver_connection
+            await driver_connection.add_listener(PHONE_MESSAGE_CHANNEL, on_notify)
+        except Exception as e:
+            logger.debug(f"LISTEN {PHONE_MESSAGE_CHANNEL} недоступен, используется опрос: {e}")
+            await connection.close()
+            yield asyncio.sleep
+            return
+
+        async def wait(timeout: float) -> None:
+            try:
+                await asyncio.wait_for(notified.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            notified.clear()
+
+        try:
+            yield wait
+        finally:
+            try:
+                await driver_connection.remove_listener(PHONE_MESSAGE_CHANNEL, on_notify)
+            finally:
+                await connection.close()
+
+    @async_retry_on_exception()
+    async def get_phone_message(self, user: str, phone: str, marketplace: str) -> str:
+        query = select(PhoneMessage).filter(
+            f.lower(PhoneMessage.user) == user.lower(),
+            PhoneMessage.phone == phone,
+            PhoneMessage.marketplace == marketplace
+        ).order_by(PhoneMessage.time_request.desc()).limit(1)
+
+        async with self.sessionmaker() as session:
+            async with self.phone_message_listener() as wait:
+                deadline = asyncio.get_running_loop().time() + PHONE_MESSAGE_TIMEOUT
+                while True:
+                    check = await session.scalar(query.execution_options(populate_existing=True))
+                    await session.commit()
+
+                    if check is None:
+                        raise Exception('Ошибка получения сообщения')
+
+                    if check.message is not None:
+                        return check.message
+
+                    remaining = deadline - asyncio.get_running_loop().time()
+                    if remaining <= 0:
+                        break
+                    await wait(min(remaining, PHONE_MESSAGE_POLL))
+
+            await session.delete(check)
+            await session.commit()
+        raise Exception("Превышен лимит ожидания сообщения")
+
+    @async_retry_on_exception()
+    async def check_phone_message(self, user: str, phone: str, time_request: datetime.datetime) -> None:
+        query = select(PhoneMessage).filter(
+            PhoneMessage.phone == phone,
+            PhoneMessage.time_request >= time_request - datetime.timedelta(minutes=2),
+            PhoneMessage.time_response.is_(None)
+        )
+        async with self.sessionmaker() as session:
+            for _ in range(20):
+                check = (await session.scalars(query.execution_options(populate_existing=True))).all()
+                await session.commit()
+                if any([row.user.lower() == user.lower() for row in check]):
+                    raise Exception("Данный пользователь уже ждёт авторизации")
+
+                if not check:
+                    break
+                await asyncio.sleep(5)
+            else:
+                raise Exception("Превышен лимит ожидания очереди")
+
+    @async_retry_on_exception()
+    async def add_phone_message(self, user: str, phone: str, marketplace: str,
+                                time_request: datetime.datetime) -> None:
+        async with self.sessionmaker() as session:
+            user = await session.scalar(select(User).filter(f.lower(User.user) == user.lower()).limit(1))
+            if user is None:
+                raise Exception("Такого пользователя не существует")
+            session.add(PhoneMessage(user=user.user,
+                                     phone=phone,
+                                     marketplace=marketplace,
+                                     time_request=time_request))
+            await session.commit()
+
+    @async_retry_on_exception()
+    async def update_phone_message(self, user: str, phone: str, marketplace: str, message: str,
+                                   time_response: datetime.datetime) -> None:
+        async with self.sessionmaker() as session:
+            mes = await session.scalar(select(PhoneMessage).filter(
+                f.lower(PhoneMessage.user) == user.lower(),
+                PhoneMessage.phone == phone,
+                PhoneMessage.marketplace == marketplace,
+                PhoneMessage.time_response.is_(None),
+                PhoneMessage.message.is_(None),
+                PhoneMessage.time_request <= time_response + datetime.timedelta(seconds=2),
+                PhoneMessage.time_request >= time_response - datetime.timedelta(minutes=2)
+            ).order_by(PhoneMessage.time_request.asc()).limit(1))
+
+            if mes:
+                mes.time_response = time_response
+                mes.message = message
+                await session.commit()
+            else:
+                raise Exception("Нет запроса")
+
+    @async_retry_on_exception()
+    async def add_wb_report_daily_entry(self, client_id: str, list_report: Report, date: datetime.date,
+                                        realizationreport_id: str) -> None:
+        """
+        Заменяет строки отчёта в wb_report_daily одной транзакцией.
+
+        Для asyncpg строки загружаются через copy_records_to_table во временную таблицу, затем старые строки
+        отчёта удаляются и новые переносятся из неё. Для прочих драйверов строки вставляются пачками INSERT.
+        """
+        async with self.sessionmaker() as session:
+            classifier = TypeServicesClassifier(
+                (await session.execute(select(WBTypeServices.operation_type, WBTypeServices.service))).all())
+        for operation_type, service in report_operation_types(list_report):
+            classifier.classify(operation_type, service)
+        if classifier.new_types:
+            await self._add_new_type_services(classifier.new_types)
+
+        async with self.sessionmaker() as session:
+            if self.engine.dialect.driver == 'asyncpg':
+                await self._replace_report_copy(session, client_id=client_id, list_report=list_report, date=date,
+                                                realizationreport_id=realizationreport_id)
+            else:
+                await session.execute(delete(WBReportDaily).filter_by(operation_date=date,
+                                                                      client_id=client_id,
+                                                                      realizationreport_id=realizationreport_id))
+                values = iter_report_values(list_report)
+                while chunk := list(islice(values, BULK_CHUNK_SIZE)):
+                    await session.execute(insert(WBReportDaily),
+                                          [dict(zip(REPORT_COLUMNS, (client_id, *row))) for row in chunk])
+            await session.commit()
+
+        if client_id in self.reports_id:
+            self.reports_id[client_id].add(realizationreport_id)
+        logger.info(f"Успешное добавление в базу отчёта {realizationreport_id}")
+
+    async def _add_new_type_services(self, new_types: list[tuple[str, Optional[str]]]) -> None:
+        """Добавляет новые типы услуг отдельной транзакцией без дублей, как DbConnection._add_new_type_services."""
+        wait_start = time.perf_counter()
+        async with self._type_services_lock, self.sessionmaker() as session:
+            if self.engine.dialect.name == 'postgresql':
+                await session.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"),
+                                      {'key': WBTypeServices.__tablename__})
+            metrics.db_wait('type_services', time.perf_counter() - wait_start)
+
+            classifier = TypeServicesClassifier(
+                (await session.execute(select(WBTypeServices.operation_type, WBTypeServices.service))).all())
+            new_types = [key for key in new_types if not classifier.classify(*key)]
+            if new_types:
+                await session.execute(insert(WBTypeServices),
+                                      [{'operation_type': operation_type, 'service': service, 'type_name': 'new'}
+                                       for operation_type, service in new_types])
+            await session.commit()
+
+    @staticmethod
+    async def _replace_report_copy(session: AsyncSession, client_id: str, list_report: Report,
+                                   date: datetime.date, realizationreport_id: str) -> None:
+        """Замена строк отчёта через временную таблицу, как DbConnection._replace_report_copy."""
+        table = WBReportDaily.__tablename__
+        stage = f"{table}_stage"
+        columns = ', '.join(REPORT_COLUMNS)
+        await session.execute(text(f"CREATE TEMP TABLE {stage} ON COMMIT DROP AS "
+                                   f"SELECT {columns} FROM {table} WITH NO DATA"))
+
+        connection = await session.connection()
+        driver_connection = (await connection.get_raw_connection()).driver_connection
+        values = iter_report_values(list_report)
+        while chunk := list(islice(values, BULK_CHUNK_SIZE)):
+            await driver_connection.copy_records_to_table(stage, records=[(client_id, *row) for row in chunk],
+                                                          columns=REPORT_COLUMNS)
+
+        wait_start = time.perf_counter()
+        await session.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"),
+                              {'key': f"{table}:{client_id}:{realizationreport_id}"})
+        metrics.db_wait('replace_report', time.perf_counter() - wait_start)
+        await session.execute(text(f"DELETE FROM {table} WHERE operation_date = :date AND client_id = :client_id "
+                                   f"AND realizationreport_id = :realizationreport_id"),
+                              {'date': date, 'client_id': client_id, 'realizationreport_id': realizationreport_id})
+        await session.execute(text(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {stage}"))
+
+    @async_retry_on_exception()
+    async def get_reports_id(self, client_id: str, refresh: bool = False) -> set[str]:
+        """
+        Возвращает id загруженных отчётов клиента.
+
+        Набор читается из базы один раз за запуск и дополняется при каждой успешной загрузке отчёта.
+        """
+        if refresh or client_id not in self.reports_id:
+            async with self.sessionmaker() as session:
+                report_ids = await session.scalars(select(WBReportDaily.realizationreport_id).filter_by(
+                    client_id=client_id).distinct())
+                self.reports_id[client_id] = set(report_ids.all())
+        return self.reports_id[client_id]
@@ -0,0 +1,62 @@
+from typing import Iterable, Optional
+
+_TERMINAL = object()
+
+
+class TypeServicesClassifier:
+    """
+    Сопоставление строк отчёта с типами услуг wb_type_services.
+
+    Строка (operation_type, bonus_type_name) считается известной, если для того же operation_type есть запись:
+    - с service=None, когда bonus_type_name тоже None;
+    - с service, являющимся префиксом bonus_type_name.
+
+    Для каждого operation_type хранится префиксное дерево значений service, поэтому проверка строки
+    не зависит от количества известных типов.
+    """
+
+    def __init__(self, type_services: Iterable[tuple[str, Optional[str]]]) -> None:
+        self._without_service: set[str] = set()
+        self._tries: dict[str, dict] = {}
+        self._checked: dict[tuple[str, Optional[str]], bool] = {}
+        self.new_types: list[tuple[str, Optional[str]]] = []
+
+        for operation_type, service in type_services:
+            self._add(operation_type, service)
+
+    def _add(self, operation_type: str, service: Optional[str]) -> None:
+        if service is None:
+            self._without_service.add(operation_type)
+            return
+        node = self._tries.setdefault(operation_type, {})
+        for char in service:
+            node = node.setdefault(char, {})
+        node[_TERMINAL] = True
+
+    def _match(self, operation_type: str, service: Optional[str]) -> bool:
+        if service is None:
+            return operation_type in self._without_service
+        node = self._tries.get(operation_type)
+        if node is None:
+            return False
+        if _TERMINAL in node:
+            return True
+        for char in service:
+            node = node.get(char)
+            if node is None:
+                return False
+            if _TERMINAL in node:
+                return True
+        return False
+
+    def classify(self, operation_type: str, service: Optional[str]) -> bool:
+        """Проверяет строку и запоминает неизвестный тип в new_types. Возвращает True, если тип был известен."""
+        key = (operation_type, service)
+        known = self._checked.get(key)
+        if known is None:
+            known = self._match(operation_type, service)
+            if not known:
+                self._add(operation_type, service)
+                self.new_types.append(key)
+            self._checked[key] = True
+        return known
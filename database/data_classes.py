@@ -1,9 +1,13 @@
 import datetime
 
-from dataclasses import dataclass
+import numpy as np
 
+from operator import attrgetter
+from typing import Iterator, Optional, Union
+from dataclasses import dataclass, fields
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class DataWBReportDaily:
     realizationreport_id: str
     gi_id: str
@@ -63,3 +67,92 @@ class DataWBReportDaily:
     deduction: float
     acceptance: float
     posting_number: str
+
+
+REPORT_FIELDS = tuple(field.name for field in fields(DataWBReportDaily))
+
+get_report_values = attrgetter(*REPORT_FIELDS)
+
+
+class ReportRow:
+    """Строка ReportBatch без копирования: значения полей читаются из столбцов по индексу строки."""
+
+    __slots__ = ('_columns', '_index')
+
+    def __init__(self, columns: dict[str, np.ndarray], index: int) -> None:
+        self._columns = columns
+        self._index = index
+
+    def __getattr__(self, name: str):
+        try:
+            value = self._columns[name][self._index]
+        except KeyError:
+            raise AttributeError(name) from None
+        return value.item() if isinstance(value, np.generic) else value
+
+    def __repr__(self) -> str:
+        return f"ReportRow({self._index})"
+
+    def to_data(self) -> DataWBReportDaily:
+        return DataWBReportDaily(*(getattr(self, name) for name in REPORT_FIELDS))
+
+
+class ReportBatch:
+    """
+    Столбцовое представление строк отчёта: по одному массиву NumPy на поле DataWBReportDaily.
+
+    Числовые поля и даты хранятся типизированными массивами, строки - массивами объектов, одинаковые значения
+    в которых ссылаются на один объект. batch[i] и итерация отдают ReportRow без копирования строки,
+    загрузчик в базу и сопоставление типов услуг читают столбцы напрямую через rows() и operation_types().
+    """
+
+    def __init__(self, columns: dict[str, np.ndarray]) -> None:
+        self.columns = {name: columns[name] for name in REPORT_FIELDS}
+        self._length = len(self.columns[REPORT_FIELDS[0]])
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[ReportRow, 'ReportBatch']:
+        if isinstance(index, slice):
+            return ReportBatch({name: column[index] for name, column in self.columns.items()})
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(index)
+        return ReportRow(self.columns, index)
+
+    def __iter__(self) -> Iterator[ReportRow]:
+        for index in range(self._length):
+            yield ReportRow(self.columns, index)
+
+    def column(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def slice(self, start: int, stop: Optional[int] = None) -> 'ReportBatch':
+        return self[start:stop]
+
+    def rows(self) -> Iterator[tuple]:
+        """Значения строк в порядке REPORT_FIELDS, приведённые к типам Python."""
+        return zip(*(column.tolist() for column in self.columns.values()))
+
+    def operation_types(self) -> dict[tuple[str, Optional[str]], None]:
+        return dict.fromkeys(zip(self.columns['supplier_oper_name'].tolist(),
+                                 self.columns['bonus_type_name'].tolist()))
+
+
+Report = Union[list[DataWBReportDaily], ReportBatch]
+
+
+def iter_report_values(report: Report) -> Iterator[tuple]:
+    """Значения строк отчёта в порядке REPORT_FIELDS."""
+    if isinstance(report, ReportBatch):
+        return report.rows()
+    return map(get_report_values, report)
+
+
+def report_operation_types(report: Report) -> dict[tuple[str, Optional[str]], None]:
+    """Уникальные пары (supplier_oper_name, bonus_type_name) отчёта в порядке появления."""
+    if isinstance(report, ReportBatch):
+        return report.operation_types()
+    return dict.fromkeys((row.supplier_oper_name, row.bonus_type_name) for row in report)
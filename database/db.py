@@ -1,19 +1,41 @@
+import io
 import time
+import select
 import logging
+import threading
 import datetime
 
-from typing import Type
+from typing import Type, Callable, Iterator, Optional
 from functools import wraps
-from sqlalchemy.orm import Session
+from contextlib import contextmanager
+from itertools import islice
+from sqlalchemy.orm import Session, sessionmaker, selectinload
 from pyodbc import Error as PyodbcError
 from sqlalchemy.exc import OperationalError
-from sqlalchemy import create_engine, func as f
+from sqlalchemy import create_engine, insert, text, func as f
 
+from log_api.metrics import metrics
 from database.models import *
-from database.data_classes import DataWBReportDaily
+from database.classifier import TypeServicesClassifier
+from database.data_classes import Report, REPORT_FIELDS, iter_report_values, report_operation_types
 
 logger = logging.getLogger(__name__)
 
+BULK_CHUNK_SIZE = 10000
+PHONE_MESSAGE_POLL = 5
+PHONE_MESSAGE_TIMEOUT = 100
+REPORT_COLUMNS = ('client_id', *REPORT_FIELDS)
+
+# Вставка новых типов услуг из параллельных загрузок одного процесса
+TYPE_SERVICES_LOCK = threading.Lock()
+
+
+def copy_value(value) -> str:
+    """Приводит значение к текстовому формату COPY."""
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
 
 def retry_on_exception(retries=3, delay=10):
     def decorator(func):
@@ -26,14 +48,11 @@ def retry_on_exception(retries=3, delay=10):
                     return result
                 except (OperationalError, PyodbcError) as e:
                     attempt += 1
+                    metrics.retry(func.__name__)
                     logger.debug(f"Error occurred: {e}. Retrying {attempt}/{retries} after {delay} seconds...")
                     time.sleep(delay)
-                    if hasattr(self, 'session'):
-                        self.session.rollback()
                 except Exception as e:
                     logger.error(f"An unexpected error occurred: {e}. Rolling back...")
-                    if hasattr(self, 'session'):
-                        self.session.rollback()
                     raise e
             raise RuntimeError("Max retries exceeded. Operation failed.")
 
@@ -56,191 +75,291 @@ class DbConnection:
                                                   "keepalives_interval": 60,
                                                   "keepalives_count": 20,
                                                   "connect_timeout": 10})
-        self.session = Session(self.engine)
+        # Сессия открывается на каждую операцию и закрывается после неё, загруженные объекты остаются доступны
+        self.sessionmaker = sessionmaker(self.engine, expire_on_commit=False)
+        self.reports_id: dict[str, set[str]] = {}
+
+    def close(self) -> None:
+        self.engine.dispose()
 
     @retry_on_exception()
     def get_markets(self, marketplace: str = 'WB') -> list[Type[Market]]:
-        markets = self.session.query(Market).filter_by(marketplace=marketplace).all()
+        with self.sessionmaker() as session:
+            markets = session.query(Market).filter_by(marketplace=marketplace).options(
+                selectinload(Market.marketplace_info), selectinload(Market.connect_info)).all()
         return markets
 
     @retry_on_exception()
     def get_marketplace(self, marketplace: str = 'WB') -> Type[Marketplace]:
-        marketplace = self.session.query(Marketplace).filter_by(marketplace=marketplace).first()
+        with self.sessionmaker() as session:
+            marketplace = session.query(Marketplace).filter_by(marketplace=marketplace).first()
         return marketplace
 
     @retry_on_exception()
     def check_user(self, login: str, password: str):
-        user = self.session.query(User).filter(f.lower(User.user) == login.lower(),
-                                               User.password == password).first()
+        with self.sessionmaker() as session:
+            user = session.query(User).filter(f.lower(User.user) == login.lower(),
+                                              User.password == password).first()
         if user is not None:
             return user.group
 
+    @contextmanager
+    def phone_message_listener(self) -> Iterator[Callable[[float], None]]:
+        """
+        Подписка на уведомления о записи кода в phone_message (LISTEN).
+
+        Отдаёт функцию ожидания wait(timeout), которая возвращается сразу после уведомления или по таймауту.
+        Если подписаться не удалось, wait(timeout) просто спит timeout секунд.
+        """
+        connection = None
+        try:
+            connection = self.engine.raw_connection()
+            driver_connection = connection.driver_connection
+            driver_connection.autocommit = True
+            with driver_connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {PHONE_MESSAGE_CHANNEL}")
+        except Exception as e:
+            logger.debug(f"LISTEN {PHONE_MESSAGE_CHANNEL} недоступен, используется опрос: {e}")
+            if connection is not None:
+                connection.invalidate()
+            yield time.sleep
+            return
+
+        def wait(timeout: float) -> None:
+            if select.select([driver_connection], [], [], timeout) != ([], [], []):
+                driver_connection.poll()
+                driver_connection.notifies.clear()
+
+        try:
+            yield wait
+        finally:
+            try:
+                with driver_connection.cursor() as cursor:
+                    cursor.execute(f"UNLISTEN {PHONE_MESSAGE_CHANNEL}")
+                driver_connection.autocommit = False
+                connection.close()
+            except Exception:
+                connection.invalidate()
+
+    @retry_on_exception()
+    def install_phone_message_trigger(self) -> None:
+        """Создаёт или обновляет триггер уведомлений phone_message в уже существующей базе."""
+        with self.engine.begin() as connection:
+            connection.execute(phone_message_notify)
+
+    @retry_on_exception()
+    def install_report_index(self) -> None:
+        """Создаёт индексы wb_report_daily (wb_report_daily_report_idx) в уже существующей базе, если их нет."""
+        with self.engine.begin() as connection:
+            for index in WBReportDaily.__table__.indexes:
+                index.create(connection, checkfirst=True)
+
     @retry_on_exception()
     def get_phone_message(self, user: str, phone: str, marketplace: str) -> str:
-        check = None
-        for _ in range(20):
-            check = self.session.query(PhoneMessage).filter(
-                f.lower(PhoneMessage.user) == user.lower(),
-                PhoneMessage.phone == phone,
-                PhoneMessage.marketplace == marketplace
-            ).order_by(PhoneMessage.time_request.desc()).first()
+        with self.sessionmaker() as session, self.phone_message_listener() as wait:
+            deadline = time.monotonic() + PHONE_MESSAGE_TIMEOUT
+            while True:
+                check = session.query(PhoneMessage).filter(
+                    f.lower(PhoneMessage.user) == user.lower(),
+                    PhoneMessage.phone == phone,
+                    PhoneMessage.marketplace == marketplace
+                ).order_by(PhoneMessage.time_request.desc()).first()
 
-            if check is None:
-                raise Exception('Ошибка получения сообщения')
+                if check is None:
+                    raise Exception('Ошибка получения сообщения')
 
-            if check.message is not None:
-                return check.message
+                if check.message is not None:
+                    return check.message
 
-            self.session.expire(check)
-            time.sleep(5)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                session.expire(check)
+                wait(min(remaining, PHONE_MESSAGE_POLL))
 
-        self.session.delete(check)
-        self.session.commit()
+            session.delete(check)
+            session.commit()
         raise Exception("Превышен лимит ожидания сообщения")
 
     @retry_on_exception()
     def check_phone_message(self, user: str, phone: str, time_request: datetime.datetime) -> None:
-        for _ in range(20):
-            check = self.session.query(PhoneMessage).filter(
-                PhoneMessage.phone == phone,
-                PhoneMessage.time_request >= time_request - datetime.timedelta(minutes=2),
-                PhoneMessage.time_response.is_(None)
-            ).all()
-            if any([row.user.lower() == user.lower() for row in check]):
-                raise Exception("Данный пользователь уже ждёт авторизации")
-
-            if not check:
-                break
-            self.session.expire(check)
-            time.sleep(5)
-        else:
-            raise Exception("Превышен лимит ожидания очереди")
+        with self.sessionmaker() as session:
+            for _ in range(20):
+                check = session.query(PhoneMessage).filter(
+                    PhoneMessage.phone == phone,
+                    PhoneMessage.time_request >= time_request - datetime.timedelta(minutes=2),
+                    PhoneMessage.time_response.is_(None)
+                ).all()
+                if any([row.user.lower() == user.lower() for row in check]):
+                    raise Exception("Данный пользователь уже ждёт авторизации")
+
+                if not check:
+                    break
+                session.expire(check)
+                time.sleep(5)
+            else:
+                raise Exception("Превышен лимит ожидания очереди")
 
     @retry_on_exception()
     def add_phone_message(self, user: str, phone: str, marketplace: str, time_request: datetime.datetime) -> None:
-        user = self.session.query(User).filter(f.lower(User.user) == user.lower()).first()
-        if user is None:
-            raise Exception("Такого пользователя не существует")
-        new = PhoneMessage(user=user.user,
-                           phone=phone,
-                           marketplace=marketplace,
-                           time_request=time_request)
-        self.session.add(new)
-        self.session.commit()
+        with self.sessionmaker() as session:
+            user = session.query(User).filter(f.lower(User.user) == user.lower()).first()
+            if user is None:
+                raise Exception("Такого пользователя не существует")
+            new = PhoneMessage(user=user.user,
+                               phone=phone,
+                               marketplace=marketplace,
+                               time_request=time_request)
+            session.add(new)
+            session.commit()
 
     @retry_on_exception()
     def update_phone_message(self, user: str, phone: str, marketplace: str, message: str,
                              time_response: datetime.datetime) -> None:
-        mes = self.session.query(PhoneMessage).filter(
-            f.lower(PhoneMessage.user) == user.lower(),
-            PhoneMessage.phone == phone,
-            PhoneMessage.marketplace == marketplace,
-            PhoneMessage.time_response.is_(None),
-            PhoneMessage.message.is_(None),
-            PhoneMessage.time_request <= time_response + datetime.timedelta(seconds=2),
-            PhoneMessage.time_request >= time_response - datetime.timedelta(minutes=2)
-        ).order_by(PhoneMessage.time_request.asc()).first()
-
-        if mes:
-            mes.time_response = time_response
-            mes.message = message
-            self.session.commit()
-        else:
-            raise Exception("Нет запроса")
+        with self.sessionmaker() as session:
+            mes = session.query(PhoneMessage).filter(
+                f.lower(PhoneMessage.user) == user.lower(),
+                PhoneMessage.phone == phone,
+                PhoneMessage.marketplace == marketplace,
+                PhoneMessage.time_response.is_(None),
+                PhoneMessage.message.is_(None),
+                PhoneMessage.time_request <= time_response + datetime.timedelta(seconds=2),
+                PhoneMessage.time_request >= time_response - datetime.timedelta(minutes=2)
+            ).order_by(PhoneMessage.time_request.asc()).first()
+
+            if mes:
+                mes.time_response = time_response
+                mes.message = message
+                session.commit()
+            else:
+                raise Exception("Нет запроса")
 
     @retry_on_exception()
-    def add_wb_report_daily_entry(self, client_id: str, list_report: list[DataWBReportDaily], date: datetime.date,
-                                  realizationreport_id: str) -> None:
-        self.session.query(WBReportDaily).filter_by(
-            operation_date=date,
-            client_id=client_id,
-            realizationreport_id=realizationreport_id).delete()
-        self.session.commit()
-
-        type_services = set(self.session.query(WBTypeServices.operation_type,
-                                               WBTypeServices.service).all())
-        for row in list_report:
-            match_found = any(
-                row.supplier_oper_name == existing_type[0] and (
-                        (existing_type[1] is None and row.bonus_type_name is None) or
-                        (existing_type[1] is not None and row.bonus_type_name is not None
-                         and row.bonus_type_name.startswith(existing_type[1]))
-                )
-                for existing_type in type_services
-            )
-            if not match_found:
-                new_type = WBTypeServices(operation_type=row.supplier_oper_name,
-                                          service=row.bonus_type_name,
-                                          type_name='new')
-                self.session.add(new_type)
-                type_services.add((row.supplier_oper_name, row.bonus_type_name))
-
-            new = WBReportDaily(client_id=client_id,
-                                realizationreport_id=row.realizationreport_id,
-                                gi_id=row.gi_id,
-                                subject_name=row.subject_name,
-                                sku=row.sku,
-                                brand=row.brand,
-                                vendor_code=row.vendor_code,
-                                size=row.size,
-                                barcode=row.barcode,
-                                doc_type_name=row.doc_type_name,
-                                quantity=row.quantity,
-                                retail_price=row.retail_price,
-                                retail_amount=row.retail_amount,
-                                sale_percent=row.sale_percent,
-                                commission_percent=row.commission_percent,
-                                office_name=row.office_name,
-                                supplier_oper_name=row.supplier_oper_name,
-                                order_date=row.order_date,
-                                sale_date=row.sale_date,
-                                operation_date=row.operation_date,
-                                shk_id=row.shk_id,
-                                retail_price_withdisc_rub=row.retail_price_withdisc_rub,
-                                delivery_amount=row.delivery_amount,
-                                return_amount=row.return_amount,
-                                delivery_rub=row.delivery_rub,
-                                gi_box_type_name=row.gi_box_type_name,
-                                product_discount_for_report=row.product_discount_for_report,
-                                supplier_promo=row.supplier_promo,
-                                order_id=row.order_id,
-                                ppvz_spp_prc=row.ppvz_spp_prc,
-                                ppvz_kvw_prc_base=row.ppvz_kvw_prc_base,
-                                ppvz_kvw_prc=row.ppvz_kvw_prc,
-                                sup_rating_prc_up=row.sup_rating_prc_up,
-                                is_kgvp_v2=row.is_kgvp_v2,
-                                ppvz_sales_commission=row.ppvz_sales_commission,
-                                ppvz_for_pay=row.ppvz_for_pay,
-                                ppvz_reward=row.ppvz_reward,
-                                acquiring_fee=row.acquiring_fee,
-                                acquiring_bank=row.acquiring_bank,
-                                ppvz_vw=row.ppvz_vw,
-                                ppvz_vw_nds=row.ppvz_vw_nds,
-                                ppvz_office_id=row.ppvz_office_id,
-                                ppvz_office_name=row.ppvz_office_name,
-                                ppvz_supplier_id=row.ppvz_supplier_id,
-                                ppvz_supplier_name=row.ppvz_supplier_name,
-                                ppvz_inn=row.ppvz_inn,
-                                declaration_number=row.declaration_number,
-                                bonus_type_name=row.bonus_type_name,
-                                sticker_id=row.sticker_id,
-                                site_country=row.site_country,
-                                penalty=row.penalty,
-                                additional_payment=row.additional_payment,
-                                rebill_logistic_cost=row.rebill_logistic_cost,
-                                rebill_logistic_org=row.rebill_logistic_org,
-                                kiz=row.kiz,
-                                storage_fee=row.storage_fee,
-                                deduction=row.deduction,
-                                acceptance=row.acceptance,
-                                posting_number=row.posting_number)
-            self.session.add(new)
-        self.session.commit()
+    def add_wb_report_daily_entry(self, client_id: str, list_report: Report, date: datetime.date,
+                                  realizationreport_id: str, bulk: bool = True) -> None:
+        """
+        Заменяет строки отчёта в wb_report_daily одной транзакцией.
+
+        Для psycopg2 строки сначала загружаются через COPY во временную таблицу, затем старые строки отчёта
+        удаляются и новые переносятся из неё. Для прочих драйверов строки вставляются пачками INSERT,
+        при bulk=False - по одному ORM-объекту на строку. До коммита читатели видят прежнюю версию отчёта,
+        а повтор после ошибки начинает с отката и ничего не дублирует.
+        """
+        with self.sessionmaker() as session:
+            classifier = TypeServicesClassifier(session.query(WBTypeServices.operation_type,
+                                                              WBTypeServices.service).all())
+        for operation_type, service in report_operation_types(list_report):
+            classifier.classify(operation_type, service)
+        if classifier.new_types:
+            self._add_new_type_services(classifier.new_types)
+
+        with self.sessionmaker() as session:
+            if bulk and self.engine.dialect.driver == 'psycopg2':
+                self._replace_report_copy(session, client_id=client_id, list_report=list_report, date=date,
+                                          realizationreport_id=realizationreport_id)
+            else:
+                session.query(WBReportDaily).filter_by(
+                    operation_date=date,
+                    client_id=client_id,
+                    realizationreport_id=realizationreport_id).delete()
+                if bulk:
+                    self._load_report_insert(session, client_id=client_id, list_report=list_report)
+                else:
+                    self._load_report_orm(session, client_id=client_id, list_report=list_report)
+            session.commit()
+        if client_id in self.reports_id:
+            self.reports_id[client_id].add(realizationreport_id)
         logger.info(f"Успешное добавление в базу отчёта {realizationreport_id}")
 
+    def _add_new_type_services(self, new_types: list[tuple[str, Optional[str]]]) -> None:
+        """
+        Добавляет новые типы услуг отдельной короткой транзакцией.
+
+        Вставки сериализуются блокировкой процесса и advisory-блокировкой PostgreSQL, а типы перед вставкой
+        проверяются по свежему снимку таблицы, поэтому параллельные загрузки не дублируют строки.
+        """
+        wait_start = time.perf_counter()
+        with TYPE_SERVICES_LOCK, self.sessionmaker() as session:
+            if self.engine.dialect.name == 'postgresql':
+                session.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"),
+                                {'key': WBTypeServices.__tablename__})
+            metrics.db_wait('type_services', time.perf_counter() - wait_start)
+
+            classifier = TypeServicesClassifier(session.query(WBTypeServices.operation_type,
+                                                              WBTypeServices.service).all())
+            new_types = [key for key in new_types if not classifier.classify(*key)]
+            if new_types:
+                session.execute(insert(WBTypeServices),
+                                [{'operation_type': operation_type, 'service': service, 'type_name': 'new'}
+                                 for operation_type, service in new_types])
+            session.commit()
+
+    @staticmethod
+    def _load_report_orm(session: Session, client_id: str, list_report: Report) -> None:
+        """
+        Загрузка строк отчёта ORM-объектами.
+
+        Объекты сбрасываются в базу и убираются из сессии пачками по BULK_CHUNK_SIZE, поэтому память
+        не растёт с размером отчёта. Фиксация остаётся одна - на весь отчёт.
+        """
+        values = iter_report_values(list_report)
+        while chunk := list(islice(values, BULK_CHUNK_SIZE)):
+            session.add_all([WBReportDaily(client_id=client_id, **dict(zip(REPORT_FIELDS, row))) for row in chunk])
+            session.flush()
+            session.expunge_all()
+
+    @staticmethod
+    def _replace_report_copy(session: Session, client_id: str, list_report: Report, date: datetime.date,
+                             realizationreport_id: str) -> None:
+        """
+        Замена строк отчёта через временную таблицу в рамках текущей транзакции сессии.
+
+        Параллельные замены одного и того же отчёта упорядочиваются advisory-блокировкой транзакции.
+        """
+        table = WBReportDaily.__tablename__
+        stage = f"{table}_stage"
+        columns = ', '.join(REPORT_COLUMNS)
+        values = iter_report_values(list_report)
+        cursor = session.connection().connection.cursor()
+        try:
+            cursor.execute(f"CREATE TEMP TABLE {stage} ON COMMIT DROP AS "
+                           f"SELECT {columns} FROM {table} WITH NO DATA")
+            while chunk := list(islice(values, BULK_CHUNK_SIZE)):
+                buffer = io.StringIO()
+                for row in chunk:
+                    buffer.write('\t'.join(map(copy_value, (client_id, *row))) + '\n')
+                buffer.seek(0)
+                cursor.copy_expert(f"COPY {stage} ({columns}) FROM STDIN", buffer)
+
+            wait_start = time.perf_counter()
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))",
+                           (f"{table}:{client_id}:{realizationreport_id}",))
+            metrics.db_wait('replace_report', time.perf_counter() - wait_start)
+            cursor.execute(f"DELETE FROM {table} "
+                           f"WHERE operation_date = %s AND client_id = %s AND realizationreport_id = %s",
+                           (date, client_id, realizationreport_id))
+            cursor.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {stage}")
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _load_report_insert(session: Session, client_id: str, list_report: Report) -> None:
+        """Загрузка строк отчёта многострочными INSERT пачками по BULK_CHUNK_SIZE."""
+        values = iter_report_values(list_report)
+        while chunk := list(islice(values, BULK_CHUNK_SIZE)):
+            session.execute(insert(WBReportDaily),
+                            [dict(zip(REPORT_COLUMNS, (client_id, *row))) for row in chunk])
+
     @retry_on_exception()
-    def get_reports_id(self, client_id: str) -> list[str]:
-        report_ids = self.session.query(WBReportDaily.realizationreport_id).filter_by(
-            client_id=client_id).distinct().all()
-        report_ids = [r.realizationreport_id for r in report_ids]
-        return report_ids
+    def get_reports_id(self, client_id: str, refresh: bool = False) -> set[str]:
+        """
+        Возвращает id загруженных отчётов клиента.
+
+        Набор читается из базы один раз за запуск и дополняется при каждой успешной загрузке отчёта.
+        """
+        if refresh or client_id not in self.reports_id:
+            with self.sessionmaker() as session:
+                report_ids = session.query(WBReportDaily.realizationreport_id).filter_by(
+                    client_id=client_id).distinct().all()
+            self.reports_id[client_id] = {r.realizationreport_id for r in report_ids}
+        return self.reports_id[client_id]
@@ -0,0 +1,176 @@
+import os
+import sqlite3
+import hashlib
+import datetime
+import threading
+
+from typing import Optional
+
+JOURNAL_PATH = os.path.join(os.getcwd(), "reports", "journal.sqlite3")
+
+LISTED = 'listed'
+DOWNLOADED = 'downloaded'
+PARSED = 'parsed'
+LOADED = 'loaded'
+STATES = (LISTED, DOWNLOADED, PARSED, LOADED)
+
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ReportJournal:
+    """
+    Локальный журнал обработки отчётов: listed -> downloaded -> parsed -> loaded.
+
+    По каждому отчёту хранится последняя пройденная стадия, путь и хэш архива, число строк и последняя ошибка.
+    Повторный запуск пропускает пройденные стадии. Журнал - файл SQLite, его можно читать во время работы:
+        python -m database.journal
+    """
+
+    def __init__(self, path: str = JOURNAL_PATH) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS report_journal (
+                client_id TEXT NOT NULL,
+                report_id TEXT NOT NULL,
+                report_date TEXT NOT NULL,
+                state TEXT NOT NULL,
+                file_path TEXT,
+                file_hash TEXT,
+                file_size INTEGER,
+                file_mtime REAL,
+                row_count INTEGER,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (client_id, report_id)
+            )""")
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(report_journal)")}
+        for column, column_type in (('file_size', 'INTEGER'), ('file_mtime', 'REAL')):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE report_journal ADD COLUMN {column} {column_type}")
+
+    def _execute(self, sql: str, params: tuple = ()) -> list[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.datetime.now().isoformat(timespec='seconds')
+
+    def get(self, client_id: str, report_id: str) -> Optional[dict]:
+        rows = self._execute("SELECT * FROM report_journal WHERE client_id = ? AND report_id = ?",
+                             (client_id, report_id))
+        return dict(rows[0]) if rows else None
+
+    def listed(self, client_id: str, report_id: str, date: datetime.date) -> None:
+        self._execute("""
+            INSERT INTO report_journal (client_id, report_id, report_date, state, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (client_id, report_id) DO NOTHING""",
+                      (client_id, report_id, date.isoformat(), LISTED, self._now()))
+
+    def downloaded(self, client_id: str, report_id: str, date: datetime.date, file_path: str) -> None:
+        self.listed(client_id, report_id, date)
+        stat = os.stat(file_path)
+        self._execute("""
+            UPDATE report_journal SET state = ?, file_path = ?, file_hash = ?, file_size = ?, file_mtime = ?,
+                                      row_count = NULL, error = NULL, updated_at = ?
+            WHERE client_id = ? AND report_id = ?""",
+                      (DOWNLOADED, file_path, file_sha256(file_path), stat.st_size, stat.st_mtime, self._now(),
+                       client_id, report_id))
+
+    def parsed(self, client_id: str, report_id: str, row_count: int) -> None:
+        self._set_state(client_id, report_id, PARSED, row_count)
+
+    def loaded(self, client_id: str, report_id: str, row_count: int) -> None:
+        self._set_state(client_id, report_id, LOADED, row_count)
+
+    def _set_state(self, client_id: str, report_id: str, state: str, row_count: int) -> None:
+        self._execute("""
+            UPDATE report_journal SET state = ?, row_count = ?, error = NULL, updated_at = ?
+            WHERE client_id = ? AND report_id = ?""",
+                      (state, row_count, self._now(), client_id, report_id))
+
+    def failed(self, client_id: str, report_id: str, error: str) -> None:
+        self._execute("""
+            UPDATE report_journal SET attempts = attempts + 1, error = ?, updated_at = ?
+            WHERE client_id = ? AND report_id = ?""",
+                      (error, self._now(), client_id, report_id))
+
+    @staticmethod
+    def _unchanged(entry: dict, file_path: str) -> bool:
+        """
+        Совпадает ли архив file_path с записанным в журнале.
+
+        Хэш пересчитывается, только если размер совпал, а время изменения нет.
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return False
+        if stat.st_size != entry['file_size'] and entry['file_size'] is not None:
+            return False
+        if stat.st_size == entry['file_size'] and stat.st_mtime == entry['file_mtime']:
+            return True
+        return file_sha256(file_path) == entry['file_hash']
+
+    def is_downloaded(self, client_id: str, report_id: str) -> Optional[str]:
+        """Путь к ранее скачанному архиву, если он на месте и не изменился."""
+        entry = self.get(client_id, report_id)
+        if entry is None or entry['state'] == LISTED or not entry['file_path']:
+            return None
+        if not self._unchanged(entry, entry['file_path']):
+            return None
+        return entry['file_path']
+
+    def is_loaded(self, client_id: str, report_id: str, file_path: str) -> bool:
+        """Загружен ли в базу именно этот архив отчёта."""
+        entry = self.get(client_id, report_id)
+        return (entry is not None and entry['state'] == LOADED and
+                os.path.abspath(entry['file_path'] or '') == os.path.abspath(file_path) and
+                self._unchanged(entry, file_path))
+
+    def pending(self, client_id: Optional[str] = None) -> list[dict]:
+        """Незагруженные отчёты."""
+        sql = "SELECT * FROM report_journal WHERE state != ?"
+        params = (LOADED,)
+        if client_id is not None:
+            sql += " AND client_id = ?"
+            params += (client_id,)
+        return [dict(row) for row in self._execute(sql + " ORDER BY report_date, report_id", params)]
+
+    def progress(self, client_id: Optional[str] = None) -> dict[str, int]:
+        """Число отчётов по стадиям и число отчётов с ошибкой."""
+        sql = "SELECT state, COUNT(*) AS total, COUNT(error) AS errors FROM report_journal"
+        params = ()
+        if client_id is not None:
+            sql += " WHERE client_id = ?"
+            params = (client_id,)
+        rows = self._execute(sql + " GROUP BY state", params)
+        progress = dict.fromkeys(STATES, 0)
+        progress['failed'] = 0
+        for row in rows:
+            progress[row['state']] = row['total']
+            progress['failed'] += row['errors']
+        return progress
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+if __name__ == '__main__':
+    journal = ReportJournal()
+    print(journal.progress())
+    for entry in journal.pending():
+        print(f"{entry['client_id']} {entry['report_id']} {entry['report_date']} {entry['state']} "
+              f"попыток {entry['attempts']} {entry['error'] or ''}")
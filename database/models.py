@@ -1,6 +1,6 @@
 from sqlalchemy.orm import declarative_base, relationship
-from sqlalchemy import Date, String, Integer, DateTime, Numeric
-from sqlalchemy import Column, Identity, MetaData, ForeignKey, UniqueConstraint
+from sqlalchemy import DDL, Date, String, Integer, DateTime, Numeric, event
+from sqlalchemy import Column, Identity, Index, MetaData, ForeignKey, UniqueConstraint
 
 metadata = MetaData()
 Base = declarative_base(metadata=metadata)
@@ -82,6 +82,29 @@ class PhoneMessage(Base):
     )
 
 
+PHONE_MESSAGE_CHANNEL = 'phone_message'
+
+# Уведомление ожидающих ботов о записи кода в phone_message
+phone_message_notify = DDL(f"""
+CREATE OR REPLACE FUNCTION phone_message_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{PHONE_MESSAGE_CHANNEL}',
+                      json_build_object('user', NEW."user", 'phone', NEW.phone, 'marketplace', NEW.marketplace)::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS phone_message_notify ON phone_message;
+
+CREATE TRIGGER phone_message_notify
+    AFTER INSERT OR UPDATE OF message ON phone_message
+    FOR EACH ROW WHEN (NEW.message IS NOT NULL)
+    EXECUTE FUNCTION phone_message_notify();
+""")
+
+event.listen(PhoneMessage.__table__, 'after_create', phone_message_notify.execute_if(dialect='postgresql'))
+
+
 class Client(Base):
     """Модель таблицы clients."""
     __tablename__ = 'clients'
@@ -158,6 +181,10 @@ class WBReportDaily(Base):
     acceptance = Column(Numeric(precision=12, scale=2), nullable=False)
     posting_number = Column(String(length=255), nullable=False)
 
+    __table_args__ = (
+        Index('wb_report_daily_report_idx', 'client_id', 'realizationreport_id', 'operation_date'),
+    )
+
 
 class WBTypeServices(Base):
     """Модель таблицы wb_type_services."""
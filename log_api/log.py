@@ -1,29 +1,78 @@
 import os
+import time
+import queue
+import atexit
 import logging
 import requests
+import threading
 import urllib3
 
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime, timezone, timedelta
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+MOSCOW_TZ = timezone(timedelta(hours=3))
+TIME_SYNC_URL = "https://yandex.com/time/sync.json?geo=213"
+TIME_SYNC_TIMEOUT = 5
+TIME_SYNC_INTERVAL = 3600
+
+
+class MoscowClock:
+    """
+    Московское время по серверу Яндекса без запроса на каждый вызов.
+
+    Смещение локальных часов относительно сервера запрашивается один раз при создании
+    и обновляется в фоновом потоке раз в refresh_interval секунд.
+    """
+
+    def __init__(self, refresh_interval: float = TIME_SYNC_INTERVAL) -> None:
+        self.offset = 0.0
+        self.refresh_interval = refresh_interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.sync()
+
+    def sync(self) -> None:
+        try:
+            started = time.time()
+            response = requests.get(TIME_SYNC_URL, verify=False, timeout=TIME_SYNC_TIMEOUT)
+            response.raise_for_status()
+            finished = time.time()
+            self.offset = response.json().get('time') / 1000 - (started + finished) / 2
+        except (requests.exceptions.RequestException, ValueError, TypeError) as e:
+            logging.getLogger("RemoteLogger").error(f"Ошибка при получении времени: {e}")
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refresh, name="MoscowClock", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _refresh(self) -> None:
+        while not self._stop.wait(self.refresh_interval):
+            self.sync()
+
+    def from_timestamp(self, timestamp: float) -> datetime:
+        return datetime.fromtimestamp(timestamp + self.offset, tz=MOSCOW_TZ).replace(tzinfo=None)
+
+    def now(self) -> datetime:
+        return self.from_timestamp(time.time())
+
+
+clock = MoscowClock()
+clock.start()
+
 
 def get_moscow_time():
-    try:
-        response = requests.get("https://yandex.com/time/sync.json?geo=213", verify=False)
-        response.raise_for_status()
-        data = response.json()
-        moscow_time = datetime.fromtimestamp((data.get('time') / 1000),
-                                             tz=timezone(timedelta(hours=3))).replace(tzinfo=None)
-        return moscow_time
-    except requests.exceptions.RequestException as e:
-        logger.error(description=f"Ошибка при получении времени: {e}")
-        return datetime.now(tz=timezone(timedelta(hours=3))).replace(tzinfo=None)
+    return clock.now()
 
 
 class MoscowFormatter(logging.Formatter):
     def formatTime(self, record, date_fmt=None):
-        moscow_time = get_moscow_time()
+        moscow_time = clock.from_timestamp(record.created)
         if date_fmt:
             return moscow_time.strftime(date_fmt)
         else:
@@ -50,8 +99,13 @@ class RemoteLogger:
         console_handler.setFormatter(formatter)
         file_handler.setFormatter(formatter)
 
-        self.logger.addHandler(console_handler)
-        self.logger.addHandler(file_handler)
+        # Запись в консоль и файл идёт в отдельном потоке, вызов логгера только кладёт запись в очередь
+        log_queue = queue.SimpleQueue()
+        self.listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+        self.logger.addHandler(QueueHandler(log_queue))
 
     def error(self, description: str = '') -> None:
         self.logger.error(f"{description}")
@@ -59,5 +113,8 @@ class RemoteLogger:
     def info(self, description: str = '') -> None:
         self.logger.info(f"{description}")
 
+    def warning(self, description: str = '') -> None:
+        self.logger.warning(f"{description}")
+
 
 logger = RemoteLogger()
@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import threading
+
+from typing import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, asdict
+
+METRICS_DIR = "log"
+PROMETHEUS_FILE = "wb_report.prom"
+SUMMARY_FILE = "run_summary.json"
+METRIC_PREFIX = "wb_report"
+
+
+@dataclass
+class StageStats:
+    """Накопленные показатели одной стадии одного кабинета."""
+    count: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    rows: int = 0
+    bytes: int = 0
+    retries: int = 0
+    db_wait: float = 0.0
+
+    def merge(self, other: 'StageStats') -> None:
+        for name, value in asdict(other).items():
+            setattr(self, name, getattr(self, name) + value)
+
+
+# Имя метрики Prometheus, поле StageStats и описание
+PROMETHEUS_METRICS = (
+    ('stage_runs_total', 'count', 'Число выполнений стадии'),
+    ('stage_errors_total', 'errors', 'Число выполнений стадии, завершившихся ошибкой'),
+    ('stage_seconds_total', 'seconds', 'Время выполнения стадии, с'),
+    ('rows_total', 'rows', 'Обработано строк отчётов'),
+    ('bytes_total', 'bytes', 'Обработано байт архивов отчётов'),
+    ('retries_total', 'retries', 'Число повторных попыток'),
+    ('db_wait_seconds_total', 'db_wait', 'Время ожидания базы данных, с'),
+)
+
+
+def escape_label(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class RunMetrics:
+    """
+    Длительность, строки, байты, повторы и ожидание базы по стадиям каждого кабинета за один запуск.
+
+    Стадия оборачивается в stage(), который возвращает запись для строк, байт, повторов и ожидания базы
+    и добавляет её к итогам при выходе. Итоги пишутся текстовым файлом Prometheus и JSON-сводкой запуска.
+    Повторы retry() и ожидания db_wait() из кода базы относятся к текущей стадии потока или задачи asyncio.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._stages: dict[tuple[str, str], StageStats] = {}
+        self._current: ContextVar[tuple[StageStats, ...]] = ContextVar('current_stage', default=())
+
+    @contextmanager
+    def stage(self, market: str, stage: str) -> Iterator[StageStats]:
+        record = StageStats(count=1)
+        token = self._current.set(self._current.get() + (record,))
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException:
+            record.errors += 1
+            raise
+        finally:
+            record.seconds = time.perf_counter() - start
+            self._current.reset(token)
+            self.add(market, stage, record)
+
+    def retry(self, stage: str) -> None:
+        """Повторная попытка: в запись текущей стадии, а вне стадий - в итоги (market 'db', stage)."""
+        self._add_current(stage, StageStats(retries=1))
+
+    def db_wait(self, stage: str, seconds: float) -> None:
+        """Ожидание блокировки базы: в запись текущей стадии, а вне стадий - в итоги (market 'db', stage)."""
+        self._add_current(stage, StageStats(db_wait=seconds))
+
+    def _add_current(self, stage: str, record: StageStats) -> None:
+        current = self._current.get()
+        if current:
+            current[-1].merge(record)
+        else:
+            self.add('db', stage, record)
+
+    def add(self, market: str, stage: str, record: StageStats) -> None:
+        with self._lock:
+            self._stages.setdefault((market, stage), StageStats()).merge(record)
+
+    def snapshot(self) -> dict[tuple[str, str], StageStats]:
+        with self._lock:
+            return {key: StageStats(**asdict(stats)) for key, stats in self._stages.items()}
+
+    def summary(self) -> dict:
+        """Сводка запуска: показатели по кабинетам и стадиям и итог по стадиям."""
+        markets, totals = {}, {}
+        for (market, stage), stats in sorted(self.snapshot().items()):
+            markets.setdefault(market, {})[stage] = asdict(stats)
+            totals.setdefault(stage, StageStats()).merge(stats)
+        return {'started': self.started,
+                'finished': time.time(),
+                'duration': time.time() - self.started,
+                'stages': {stage: asdict(stats) for stage, stats in totals.items()},
+                'markets': markets}
+
+    def prometheus(self) -> str:
+        """Показатели в текстовом формате Prometheus."""
+        snapshot = sorted(self.snapshot().items())
+        lines = [f"# HELP {METRIC_PREFIX}_run_started_seconds Время начала запуска",
+                 f"# TYPE {METRIC_PREFIX}_run_started_seconds gauge",
+                 f"{METRIC_PREFIX}_run_started_seconds {self.started:.3f}",
+                 f"# HELP {METRIC_PREFIX}_run_duration_seconds Длительность запуска, с",
+                 f"# TYPE {METRIC_PREFIX}_run_duration_seconds gauge",
+                 f"{METRIC_PREFIX}_run_duration_seconds {time.time() - self.started:.3f}"]
+        for name, field, description in PROMETHEUS_METRICS:
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {description}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} counter")
+            for (market, stage), stats in snapshot:
+                lines.append(f'{METRIC_PREFIX}_{name}{{market="{escape_label(market)}",'
+                             f'stage="{escape_label(stage)}"}} {getattr(stats, field)}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str = METRICS_DIR) -> None:
+        """Записывает текстовый файл Prometheus и JSON-сводку в папку path."""
+        os.makedirs(path, exist_ok=True)
+        self._write_file(os.path.join(path, PROMETHEUS_FILE), self.prometheus())
+        self._write_file(os.path.join(path, SUMMARY_FILE), json.dumps(self.summary(), ensure_ascii=False, indent=2))
+
+    @staticmethod
+    def _write_file(file_path: str, content: str) -> None:
+        # Сборщик textfile читает файл в любой момент, поэтому файл заменяется целиком
+        with open(file_path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(file_path + '.tmp', file_path)
+
+
+metrics = RunMetrics()
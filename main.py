@@ -1,38 +1,145 @@
 import logging
 
+from typing import Type
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from log_api.log import logger
-from web_driver.wd import WebDriver
+from log_api.metrics import metrics
+from database.models import Market
+from web_driver.pool import BrowserPool
+from web_driver.wd import get_browser_id
 from database.db import DbConnection
-from config import DB_ADMIN_URL, DB_ARRIS_URL
+from database.journal import ReportJournal
+from config import DB_ADMIN_URL, DB_ARRIS_URL, MAX_WORKERS, DIRECT_DOWNLOAD
 
 logging.getLogger("selenium").setLevel(logging.CRITICAL)
 
 
+def group_markets(markets: list[Type[Market]]) -> list[list[int]]:
+    """
+    Разбивает кабинеты на группы, которые нельзя обрабатывать одновременно.
+
+    Кабинеты с общим телефоном (профиль браузера и СМС) или общим прокси попадают в одну группу.
+    Возвращает списки id кабинетов в исходном порядке.
+    """
+    parent = {market.id: market.id for market in markets}
+
+    def find(market_id: int) -> int:
+        while parent[market_id] != market_id:
+            parent[market_id] = parent[parent[market_id]]
+            market_id = parent[market_id]
+        return market_id
+
+    owners = {}
+    for market in markets:
+        for key in (('phone', market.connect_info.phone), ('proxy', market.connect_info.proxy)):
+            owner = owners.setdefault(key, market.id)
+            parent[find(market.id)] = find(owner)
+
+    groups = {}
+    for market in markets:
+        groups.setdefault(find(market.id), []).append(market.id)
+    return list(groups.values())
+
+
+def order_by_profile(markets: list[Type[Market]]) -> list[Type[Market]]:
+    """Кабинеты одного профиля браузера подряд, чтобы закрытый после них браузер больше не понадобился."""
+    order = {}
+    for market in markets:
+        order.setdefault(get_browser_id(market), len(order))
+    return sorted(markets, key=lambda market: order[get_browser_id(market)])
+
+
+def process_market(market: Type[Market], pool: BrowserPool) -> bool:
+    chrome_driver = pool.acquire(market)
+    chrome_driver.load_url(url=market.marketplace_info.link)
+    if chrome_driver.is_browser_active():
+        chrome_driver.stores_report_daily()
+        logger.info(f"Сбор отчётов компани {market.name_company} завершен")
+        return True
+    logger.error(f"Сбор отчётов компани {market.name_company} прерван")
+    return False
+
+
+def process_group(market_ids: list[int], journal: ReportJournal) -> dict[int, bool]:
+    """
+    Последовательно обрабатывает группу кабинетов на собственных соединениях с базой.
+
+    Браузер следующего по очереди профиля запускается заранее, пока обрабатывается текущий кабинет,
+    а браузер профиля, который дальше в группе не встречается, закрывается сразу.
+    """
+    results = {}
+    db_conn_admin = DbConnection(url=DB_ADMIN_URL)
+    db_conn_arris = DbConnection(url=DB_ARRIS_URL)
+    pool = BrowserPool(user='WBReportBot',
+                       db_conn_admin=db_conn_admin,
+                       db_conn_arris=db_conn_arris,
+                       direct_download=DIRECT_DOWNLOAD,
+                       journal=journal)
+    try:
+        markets = {market.id: market for market in db_conn_admin.get_markets()}
+        market_ids = [market.id for market in order_by_profile([markets[market_id] for market_id in market_ids])]
+        for i, market_id in enumerate(market_ids):
+            market = markets[market_id]
+            next_markets = [markets[next_id] for next_id in market_ids[i + 1:]
+                            if get_browser_id(markets[next_id]) != get_browser_id(market)]
+            if next_markets:
+                pool.prewarm(next_markets[0])
+            try:
+                results[market_id] = process_market(market=market, pool=pool)
+            except Exception as e:
+                logger.error(f"Сбор отчётов компани {market.name_company} прерван: {e}")
+                results[market_id] = False
+            # Браузер профиля закрывается сразу, если дальше в группе этот профиль не встречается
+            if all(get_browser_id(markets[next_id]) != get_browser_id(market) for next_id in market_ids[i + 1:]):
+                pool.release(market)
+    finally:
+        pool.close()
+        db_conn_admin.close()
+        db_conn_arris.close()
+    return results
+
+
+def install_database_objects(db_conn_admin: DbConnection, db_conn_arris: DbConnection) -> None:
+    """Триггер уведомлений phone_message и индекс замены отчётов в существующих базах. Ошибки не прерывают сбор."""
+    try:
+        db_conn_admin.install_phone_message_trigger()
+    except Exception as e:
+        logger.error(f"Триггер phone_message не установлен: {e}")
+    try:
+        db_conn_arris.install_report_index()
+    except Exception as e:
+        logger.error(f"Индекс wb_report_daily не создан: {e}")
+
+
 def main():
     db_conn_admin = DbConnection(url=DB_ADMIN_URL)
     db_conn_arris = DbConnection(url=DB_ARRIS_URL)
     try:
-        markets = db_conn_admin.get_markets()
-
-        for market in markets:
-            chrome_driver = WebDriver(market=market,
-                                      user='WBReportBot',
-                                      db_conn_admin=db_conn_admin,
-                                      db_conn_arris=db_conn_arris)
-            chrome_driver.load_url(url=market.marketplace_info.link)
-            if chrome_driver.is_browser_active():
-                chrome_driver.stores_report_daily()
-                chrome_driver.quit()
-                logger.info(f"Сбор отчётов компани {market.name_company} завершен")
-            else:
-                logger.error(f"Сбор отчётов компани {market.name_company} прерван")
-        else:
-            logger.info(f"Сбор отчётов завершен")
+        install_database_objects(db_conn_admin, db_conn_arris)
+        groups = group_markets(db_conn_admin.get_markets())
     except Exception as e:
         logger.error(e)
+        return
     finally:
-        db_conn_admin.session.close()
-        db_conn_arris.session.close()
+        db_conn_admin.close()
+        db_conn_arris.close()
+
+    results = {}
+    journal = ReportJournal()
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(process_group, market_ids, journal): market_ids for market_ids in groups}
+        for future in as_completed(futures):
+            try:
+                results.update(future.result())
+            except Exception as e:
+                logger.error(e)
+                results.update(dict.fromkeys(futures[future], False))
+
+    logger.info(f"Сбор отчётов завершен: успешно {sum(results.values())} из {len(results)}, "
+                f"отчёты по стадиям {journal.progress()}")
+    journal.close()
+    metrics.write()
 
 
 if __name__ == '__main__':
@@ -1 +1,2 @@
 from .wd import WebDriver
+from .pool import BrowserPool
@@ -0,0 +1,37 @@
+import re
+import json
+
+from typing import Iterator
+from seleniumwire.utils import decode
+
+from log_api import logger
+from .http_client import REPORTS_DAILY_API
+
+# seleniumwire сохраняет только запросы к API отчётов, остальной трафик браузера проходит без записи
+CAPTURE_SCOPES = [re.escape(REPORTS_DAILY_API)]
+REPORTS_LIST_PATTERN = re.escape(REPORTS_DAILY_API) + r'(\?|$)'
+
+
+def report_details_pattern(report_id: str) -> str:
+    """Запросы страницы отчёта к API за его детализацией."""
+    return re.escape(f"{REPORTS_DAILY_API}/{report_id}/details")
+
+
+def captured_json(driver, pattern: str) -> Iterator[tuple[str, dict]]:
+    """
+    Перехваченные seleniumwire JSON-ответы на запросы, URL которых соответствует pattern.
+
+    Отдаёт (url, тело ответа) в порядке отправки запросов, запросы без ответа и с ошибкой пропускаются.
+    """
+    regex = re.compile(pattern)
+    for request in driver.requests:
+        response = request.response
+        if response is None or response.status_code != 200 or not regex.search(request.url):
+            continue
+        if 'json' not in response.headers.get('Content-Type', ''):
+            continue
+        try:
+            body = decode(response.body, response.headers.get('Content-Encoding', 'identity'))
+            yield request.url, json.loads(body)
+        except ValueError as e:
+            logger.error(f"Ответ {request.url} не разобран: {e}")
@@ -1,26 +1,53 @@
 import os
 import json
+import shutil
+import hashlib
+import tempfile
 
+from typing import Optional
+from urllib.parse import urlsplit, unquote
 
-def create_proxy_auth_extension(proxy_auth_path: str, proxy: str, scheme='http') -> str:
+PROXY_SCHEMES = {'http': 'http', 'https': 'https', 'socks4': 'socks4', 'socks5': 'socks5', 'socks5h': 'socks5'}
+
+
+def parse_proxy(proxy: str, scheme: str = 'http') -> dict:
+    """
+    Разбирает прокси-строку вида <scheme>://<login>:<password>@<host>:<port>.
+
+    Если схема в строке не указана, используется scheme.
+    """
+    if '://' not in proxy:
+        proxy = f"{scheme}://{proxy}"
+    parts = urlsplit(proxy)
+    if parts.scheme not in PROXY_SCHEMES:
+        raise ValueError(f"Неподдерживаемая схема прокси: {parts.scheme}")
+    if not parts.hostname or not parts.port:
+        raise ValueError(f"В прокси не указан хост или порт: {parts.hostname}:{parts.port}")
+    return {"scheme": PROXY_SCHEMES[parts.scheme],
+            "host": parts.hostname,
+            "port": parts.port,
+            "username": unquote(parts.username or ''),
+            "password": unquote(parts.password or '')}
+
+
+def create_proxy_auth_extension(proxy_auth_path: str, proxy: str, scheme='http',
+                                prewarm_url: Optional[str] = None) -> str:
     """
     Создаёт расширения Chrome с прокси-авторизацией.
 
     Параметры:
     - proxy_auth_path: путь, куда сохранить
-    - proxy: строка вида http://<login>:<password>@<host>:<port>
-    - scheme: схема подключения (по умолчанию http)
+    - proxy: строка вида <scheme>://<login>:<password>@<host>:<port>, схемы http, https, socks4, socks5
+    - scheme: схема подключения, если она не указана в proxy (по умолчанию http)
+    - prewarm_url: адрес, запрашиваемый при старте расширения для прогрева соединения (по умолчанию не запрашивается)
+
+    Расширение кэшируется в папке с именем по хэшу своего содержимого и пересоздаётся только при его изменении.
+    Chrome передаёт логин и пароль через onAuthRequired только для http/https прокси.
 
     Возвращает:
     - путь к расширению
     """
-
-    # Разбор прокси-строки на компоненты
-    proxy_host, proxy_port = proxy.split('@')[-1].split(':')
-    proxy_user, proxy_pass = proxy.replace('http://', '').split('@')[0].split(':')
-
-    ext_path = os.path.join(proxy_auth_path, proxy_user)
-    os.makedirs(ext_path, exist_ok=True)
+    config = parse_proxy(proxy, scheme)
 
     # Содержимое manifest.json для расширения Chrome
     manifest_json = {
@@ -40,32 +67,36 @@ def create_proxy_auth_extension(proxy_auth_path: str, proxy: str, scheme='http')
         }
     }
 
+    prewarm_js = ""
+    if prewarm_url:
+        prewarm_js = f"""
+    fetch({json.dumps(prewarm_url)}, {{ mode: "no-cors" }})
+      .then(() => console.log("Pre-warmed"))
+      .catch(() => {{}});
+"""
+
     # Скрипт background.js, настраивающий прокси и авторизацию
     background_js = f"""
     const config = {{
         mode: "fixed_servers",
         rules: {{
             singleProxy: {{
-                scheme: "{scheme}",
-                host: "{proxy_host}",
-                port: parseInt("{proxy_port}")
+                scheme: {json.dumps(config["scheme"])},
+                host: {json.dumps(config["host"])},
+                port: {config["port"]}
             }},
             bypassList: ["localhost"]
         }}
     }};
 
     chrome.proxy.settings.set({{ value: config, scope: "regular" }}, function() {{}});
-
-    fetch("http://example.com")
-      .then(() => console.log("Pre-warmed"))
-      .catch(() => {{}});
-
+{prewarm_js}
     chrome.webRequest.onAuthRequired.addListener(
         function(details) {{
             return {{
                 authCredentials: {{
-                    username: "{proxy_user}",
-                    password: "{proxy_pass}"
+                    username: {json.dumps(config["username"])},
+                    password: {json.dumps(config["password"])}
                 }}
             }};
         }},
@@ -74,10 +105,25 @@ def create_proxy_auth_extension(proxy_auth_path: str, proxy: str, scheme='http')
     );
     """
 
-    # сохраняем manifest.json и background.js
-    with open(os.path.join(ext_path, "manifest.json"), "w", encoding="utf-8") as f:
-        json.dump(manifest_json, f, indent=4)
-    with open(os.path.join(ext_path, "background.js"), "w", encoding="utf-8") as f:
-        f.write(background_js)
+    manifest = json.dumps(manifest_json, indent=4)
+    digest = hashlib.sha256((manifest + background_js).encode('utf-8')).hexdigest()[:16]
+    ext_path = os.path.join(proxy_auth_path, digest)
+    if os.path.isfile(os.path.join(ext_path, "manifest.json")):
+        return ext_path
+
+    # сохраняем manifest.json и background.js во временную папку и переименовываем её целиком
+    os.makedirs(proxy_auth_path, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=proxy_auth_path, prefix=f".{digest}-")
+    try:
+        with open(os.path.join(tmp_path, "background.js"), "w", encoding="utf-8") as f:
+            f.write(background_js)
+        with open(os.path.join(tmp_path, "manifest.json"), "w", encoding="utf-8") as f:
+            f.write(manifest)
+        os.replace(tmp_path, ext_path)
+    except OSError:
+        # Параллельный запуск уже создал такое же расширение
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not os.path.isfile(os.path.join(ext_path, "manifest.json")):
+            raise
 
     return ext_path
@@ -0,0 +1,63 @@
+import os
+import threading
+
+from typing import Optional
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler, FileSystemEvent
+
+
+class DownloadWatcher(FileSystemEventHandler):
+    """
+    Отслеживает появление скачанных архивов в папке загрузок браузера по событиям файловой системы.
+
+    Chrome пишет файл как *.crdownload и по окончании переименовывает его, поэтому готовым считается
+    только созданный или переименованный *.zip.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.path = None
+        self._watch = None
+        self._files: list[str] = []
+        self._condition = threading.Condition()
+        self._observer = Observer()
+        self._observer.daemon = True
+        self._observer.start()
+
+    def watch(self, path: str) -> None:
+        """Переключает наблюдение на папку path."""
+        if self._watch is not None:
+            self._observer.unschedule(self._watch)
+        self.path = path
+        self._watch = self._observer.schedule(self, path, recursive=False)
+
+    def expect(self) -> None:
+        """Забывает ранее замеченные файлы перед началом новой загрузки."""
+        with self._condition:
+            self._files.clear()
+
+    def wait(self, report: str, timeout: float) -> Optional[str]:
+        """Ждёт появления архива отчёта report. Возвращает путь к файлу или None по таймауту."""
+        def find():
+            return next((file for file in self._files if report in os.path.basename(file)), None)
+
+        with self._condition:
+            self._condition.wait_for(find, timeout=timeout)
+            return find()
+
+    def stop(self) -> None:
+        self._observer.stop()
+
+    def _add(self, file_path: str) -> None:
+        if file_path.endswith('.zip'):
+            with self._condition:
+                self._files.append(file_path)
+                self._condition.notify_all()
+
+    def on_created(self, event: FileSystemEvent) -> None:
+        if not event.is_directory:
+            self._add(event.src_path)
+
+    def on_moved(self, event: FileSystemEvent) -> None:
+        if not event.is_directory:
+            self._add(event.dest_path)
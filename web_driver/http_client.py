@@ -0,0 +1,132 @@
+import os
+import base64
+import datetime
+
+import requests
+
+from typing import Callable, Iterator, Optional
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+from log_api import logger
+
+# Адреса API ЛК, к которым обращается страница reports-daily
+REPORTS_DAILY_API = 'https://seller-services.wildberries.ru/ns/reports/seller-wb-balance/api/v1/reports-daily'
+REPORTS_LIST_URL = REPORTS_DAILY_API + '?limit={limit}&skip={skip}'
+REPORT_ARCHIVE_URL = REPORTS_DAILY_API + '/{report_id}/details/archived-excel'
+ACCESS_TOKEN_KEY = 'wb-eu-passport-v2.access-token'
+
+REPORTS_PAGE_SIZE = 50
+DOWNLOAD_WORKERS = 4
+REQUEST_TIMEOUT = 60
+
+
+def parse_report_date(value: str) -> datetime.date:
+    """Дата отчёта из API: ISO-строка с временем или без, либо дд.мм.гггг."""
+    try:
+        return datetime.date.fromisoformat(value[:10])
+    except ValueError:
+        return datetime.datetime.strptime(value[:10], '%d.%m.%Y').date()
+
+
+def parse_reports_payload(payload: dict) -> list[tuple[str, datetime.date]]:
+    """Список (id отчёта, дата формирования) из ответа API списка отчётов."""
+    data = payload.get('data') or {}
+    items = data.get('reports') if isinstance(data, dict) else data
+    reports = []
+    for item in items or []:
+        date = item.get('createDate') or item.get('dateTo') or item.get('dateFrom')
+        if item.get('id') is None or not date:
+            continue
+        reports.append((str(item['id']), parse_report_date(date)))
+    return reports
+
+
+class ReportHttpClient:
+    """
+    Скачивание отчётов напрямую через API ЛК.
+
+    Браузер используется только для авторизации: его cookies, user-agent и токен доступа переносятся
+    в requests.Session, который ходит через тот же прокси и держит пул соединений на DOWNLOAD_WORKERS потоков.
+    """
+
+    def __init__(self, cookies: list[dict], headers: dict[str, str], proxy: Optional[str] = None,
+                 workers: int = DOWNLOAD_WORKERS, throttle: Optional[Callable[[], None]] = None) -> None:
+        self.workers = workers
+        self.throttle = throttle
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update(headers)
+        for cookie in cookies:
+            self.session.cookies.set(cookie['name'], cookie['value'],
+                                     domain=cookie.get('domain'), path=cookie.get('path', '/'))
+        if proxy:
+            self.session.proxies = {'http': proxy, 'https': proxy}
+
+    @classmethod
+    def from_driver(cls, driver, proxy: Optional[str] = None, **kwargs) -> 'ReportHttpClient':
+        headers = {'User-Agent': driver.execute_script("return navigator.userAgent"),
+                   'Accept': 'application/json, text/plain, */*',
+                   'Origin': 'https://seller.wildberries.ru',
+                   'Referer': 'https://seller.wildberries.ru/'}
+        token = driver.execute_script(f"return window.localStorage.getItem('{ACCESS_TOKEN_KEY}')")
+        if token:
+            headers['AuthorizeV3'] = token.strip('"')
+        return cls(cookies=driver.get_cookies(), headers=headers, proxy=proxy, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
+
+    def _get(self, url: str) -> requests.Response:
+        """GET с ожиданием очереди throttle, если он задан."""
+        if self.throttle is not None:
+            self.throttle()
+        response = self.session.get(url, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response
+
+    def iter_reports(self, pages: Optional[int] = None) -> Iterator[list[tuple[str, datetime.date]]]:
+        """Страницы списка (id отчёта, дата формирования) от новых к старым. pages=None - до конца списка."""
+        page = 0
+        while pages is None or page < pages:
+            response = self._get(REPORTS_LIST_URL.format(limit=REPORTS_PAGE_SIZE, skip=page * REPORTS_PAGE_SIZE))
+            page_reports = parse_reports_payload(response.json())
+            yield page_reports
+            if len(page_reports) < REPORTS_PAGE_SIZE:
+                return
+            page += 1
+
+    def list_reports(self, pages: int = 1) -> list[tuple[str, datetime.date]]:
+        """Список (id отчёта, дата формирования) с первых pages страниц."""
+        return [report for page_reports in self.iter_reports(pages) for report in page_reports]
+
+    def download_report(self, report_id: str, path: str) -> str:
+        """Скачивает архив отчёта в папку path. Возвращает путь к файлу."""
+        response = self._get(REPORT_ARCHIVE_URL.format(report_id=report_id))
+
+        if 'json' in response.headers.get('Content-Type', ''):
+            content = base64.b64decode(response.json()['data']['file'])
+        else:
+            content = response.content
+
+        file_path = os.path.join(path, f"Ежедневный отчёт №{report_id}.zip")
+        with open(file_path + '.part', 'wb') as f:
+            f.write(content)
+        os.replace(file_path + '.part', file_path)
+        return file_path
+
+    def download_reports(self, report_ids: list[str], path: str) -> dict[str, str]:
+        """Скачивает несколько отчётов параллельно. Возвращает пути к скачанным архивам по id отчёта."""
+        def download(report_id: str) -> Optional[str]:
+            try:
+                file_path = self.download_report(report_id, path)
+                logger.info(f"Загрузка файла {path}\\{report_id} завершена.")
+                return file_path
+            except Exception as e:
+                logger.error(f"Загрузка файла {path}\\{report_id} через API не удалась: {e}")
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            files = dict(zip(report_ids, executor.map(download, report_ids)))
+        return {report_id: file_path for report_id, file_path in files.items() if file_path is not None}
@@ -0,0 +1,77 @@
+import queue
+import datetime
+import threading
+
+from typing import Callable
+
+from log_api import logger
+
+PIPELINE_WORKERS = 2
+PIPELINE_QUEUE_SIZE = 4
+
+
+class PipelineError(Exception):
+    """Часть отчётов не удалось разобрать или загрузить."""
+
+    def __init__(self, errors: list[tuple[str, Exception]]) -> None:
+        self.errors = errors
+        super().__init__(f"Не загружено отчётов: {len(errors)}. " +
+                         "; ".join(f"{file_path}: {e}" for file_path, e in errors))
+
+
+class ReportPipeline:
+    """
+    Разбор и загрузка скачанных архивов в фоне, пока браузер скачивает следующие.
+
+    Браузер кладёт архивы в ограниченную очередь (submit блокируется, когда она заполнена),
+    workers потоков разбирают их и загружают в базу функцией load(file_path, date).
+    Ошибки собираются и выбрасываются из close() одним PipelineError.
+    """
+
+    def __init__(self, load: Callable[[str, datetime.date], None], workers: int = PIPELINE_WORKERS,
+                 queue_size: int = PIPELINE_QUEUE_SIZE) -> None:
+        self.load = load
+        self.processed = 0
+        self.errors: list[tuple[str, Exception]] = []
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = [threading.Thread(target=self._work, name=f"ReportPipeline-{i}", daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self) -> 'ReportPipeline':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close(raise_errors=exc_type is None)
+
+    def submit(self, file_path: str, date: datetime.date) -> None:
+        self._queue.put((file_path, date))
+
+    def _work(self) -> None:
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                file_path, date = task
+                try:
+                    self.load(file_path, date)
+                    with self._lock:
+                        self.processed += 1
+                except Exception as e:
+                    logger.error(f"Ошибка загрузки {file_path}: {e}")
+                    with self._lock:
+                        self.errors.append((file_path, e))
+            finally:
+                self._queue.task_done()
+
+    def close(self, raise_errors: bool = True) -> None:
+        """Дожидается обработки всех архивов и останавливает потоки."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        if raise_errors and self.errors:
+            raise PipelineError(self.errors)
@@ -0,0 +1,96 @@
+import threading
+
+from typing import Type, Optional
+from contextlib import suppress
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from log_api import logger
+from database.models import Market
+from database.db import DbConnection
+from database.journal import ReportJournal
+from .wd import WebDriver, launch_browser, get_browser_id
+
+
+class BrowserPool:
+    """
+    Пул браузеров по профилю (browser_id, он же телефон и прокси подключения).
+
+    Кабинеты с общим профилем получают один и тот же браузер, поэтому авторизация в ЛК
+    переиспользуется. prewarm запускает браузер следующего профиля в фоне, пока текущий кабинет
+    скачивает и загружает отчёты.
+    """
+
+    def __init__(self, user: str, db_conn_admin: DbConnection, db_conn_arris: DbConnection,
+                 direct_download: bool = False, journal: Optional[ReportJournal] = None) -> None:
+        self.user = user
+        self.journal = journal
+        self.db_conn_admin = db_conn_admin
+        self.db_conn_arris = db_conn_arris
+        self.direct_download = direct_download
+        self._browsers: dict[str, WebDriver] = {}
+        self._pending: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="BrowserPool")
+
+    def prewarm(self, market: Type[Market]) -> None:
+        """Запускает браузер для market в фоне, если для его профиля ещё нет живого или запускаемого."""
+        browser_id = get_browser_id(market)
+        proxy = market.connect_info.proxy
+        with self._lock:
+            if browser_id in self._pending or browser_id in self._browsers:
+                return
+            self._pending[browser_id] = self._executor.submit(launch_browser, browser_id, proxy)
+
+    def acquire(self, market: Type[Market]) -> WebDriver:
+        """Браузер для market: живой из пула, заранее запущенный или новый."""
+        browser_id = get_browser_id(market)
+        with self._lock:
+            browser = self._browsers.pop(browser_id, None)
+            pending = self._pending.pop(browser_id, None)
+
+        if browser is not None:
+            if browser.is_browser_active():
+                browser.bind(market)
+                with self._lock:
+                    self._browsers[browser_id] = browser
+                return browser
+            with suppress(Exception):
+                browser.quit()
+
+        driver = None
+        if pending is not None:
+            try:
+                driver = pending.result()
+            except Exception as e:
+                logger.error(f"Не удалось заранее запустить браузер {browser_id}: {e}")
+
+        browser = WebDriver(market=market,
+                            user=self.user,
+                            db_conn_admin=self.db_conn_admin,
+                            db_conn_arris=self.db_conn_arris,
+                            direct_download=self.direct_download,
+                            driver=driver,
+                            journal=self.journal)
+        with self._lock:
+            self._browsers[browser_id] = browser
+        return browser
+
+    def release(self, market: Type[Market]) -> None:
+        """Закрывает браузер профиля market, если он больше не понадобится."""
+        with self._lock:
+            browser = self._browsers.pop(get_browser_id(market), None)
+        if browser is not None:
+            with suppress(Exception):
+                browser.quit()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        for future in self._pending.values():
+            if future.exception() is None:
+                with suppress(Exception):
+                    future.result().quit()
+        for browser in self._browsers.values():
+            with suppress(Exception):
+                browser.quit()
+        self._pending.clear()
+        self._browsers.clear()
@@ -0,0 +1,81 @@
+import os
+import glob
+import datetime
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from typing import Optional, Callable
+
+from database.journal import file_sha256
+from database.data_classes import ReportBatch, REPORT_FIELDS
+from .report_reader import share_strings, read_report_archive
+
+CACHE_PATH = os.path.join(os.getcwd(), "reports", "cache")
+HASH_LENGTH = 16
+
+
+class ReportCache:
+    """
+    Кэш разобранных отчётов в Parquet.
+
+    Каждый отчёт хранится один раз в файле <id отчёта>-<хэш архива>.parquet: повторная загрузка того же архива
+    читает столбцы из Parquet вместо разбора xlsx, а изменённый архив разбирается заново.
+    """
+
+    def __init__(self, path: str = CACHE_PATH) -> None:
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file_path(self, realizationreport_id: str, file_hash: str) -> str:
+        return os.path.join(self.path, f"{realizationreport_id}-{file_hash[:HASH_LENGTH]}.parquet")
+
+    def get(self, realizationreport_id: str, file_hash: Optional[str] = None) -> Optional[ReportBatch]:
+        """
+        Разобранный отчёт из кэша или None.
+
+        Без file_hash возвращается последний сохранённый вариант отчёта - для сверок и перезагрузок без архива.
+        """
+        if file_hash is not None:
+            file_path = self._file_path(realizationreport_id, file_hash)
+            if not os.path.isfile(file_path):
+                return None
+        else:
+            files = glob.glob(os.path.join(glob.escape(self.path), f"{glob.escape(realizationreport_id)}-*.parquet"))
+            if not files:
+                return None
+            file_path = max(files, key=os.path.getmtime)
+
+        table = pq.read_table(file_path)
+        columns = {}
+        for name in REPORT_FIELDS:
+            values = table.column(name).to_numpy()
+            columns[name] = share_strings(values) if values.dtype == object else values
+        return ReportBatch(columns)
+
+    def put(self, realizationreport_id: str, file_hash: str, batch: ReportBatch) -> str:
+        """Сохраняет разобранный отчёт. Возвращает путь к файлу кэша."""
+        file_path = self._file_path(realizationreport_id, file_hash)
+        table = pa.table({name: pa.array(np.ascontiguousarray(batch.column(name)), from_pandas=True)
+                          for name in REPORT_FIELDS})
+        pq.write_table(table, file_path + '.part')
+        os.replace(file_path + '.part', file_path)
+        return file_path
+
+    def load(self, zip_file_path: str, realizationreport_id: str, date: datetime.date,
+             parse: Callable[[str, str, datetime.date], ReportBatch] = read_report_archive) -> ReportBatch:
+        """
+        Отчёт из архива zip_file_path: из кэша, если этот архив уже разбирался, иначе parse с записью в кэш.
+
+        Дата отчёта в кэше не участвует в ключе, поэтому operation_date всегда берётся из date.
+        """
+        file_hash = file_sha256(zip_file_path)
+        batch = self.get(realizationreport_id, file_hash)
+        if batch is None:
+            batch = parse(zip_file_path, realizationreport_id, date)
+            self.put(realizationreport_id, file_hash, batch)
+            return batch
+
+        batch.columns['operation_date'] = np.broadcast_to(np.datetime64(date, 'D'), len(batch))
+        return batch
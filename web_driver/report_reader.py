@@ -0,0 +1,192 @@
+import io
+import re
+import zipfile
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from typing import Iterator
+from contextlib import contextmanager
+
+from log_api import logger
+from database.data_classes import ReportBatch
+
+LEGACY_COLUMNS_COUNT = 62
+
+# Поле DataWBReportDaily: (заголовок столбца отчёта WB, позиция столбца в старом формате, тип значения)
+REPORT_COLUMNS_MAP = {
+    'gi_id': ('Номер поставки', 1, 'str'),
+    'subject_name': ('Предмет', 2, 'str'),
+    'sku': ('Код номенклатуры', 3, 'str'),
+    'brand': ('Бренд', 4, 'str'),
+    'vendor_code': ('Артикул поставщика', 5, 'str'),
+    'size': ('Размер', 7, 'str'),
+    'barcode': ('Баркод', 8, 'str'),
+    'doc_type_name': ('Тип документа', 9, 'str'),
+    'supplier_oper_name': ('Обоснование для оплаты', 10, 'str'),
+    'order_date': ('Дата заказа покупателем', 11, 'date'),
+    'sale_date': ('Дата продажи', 12, 'date'),
+    'quantity': ('Кол-во', 13, 'int'),
+    'retail_price': ('Цена розничная', 14, 'float'),
+    'retail_amount': ('Вайлдберриз реализовал Товар (Пр)', 15, 'float'),
+    'product_discount_for_report': ('Согласованный продуктовый дисконт, %', 16, 'float'),
+    'supplier_promo': ('Промокод %', 17, 'float_or_zero'),
+    'sale_percent': ('Итоговая согласованная скидка, %', 18, 'int'),
+    'retail_price_withdisc_rub': ('Цена розничная с учетом согласованной скидки', 19, 'float'),
+    'sup_rating_prc_up': ('Размер снижения кВВ из-за рейтинга, %', 20, 'float'),
+    'is_kgvp_v2': ('Размер изменения кВВ из-за акции, %', 21, 'float'),
+    'ppvz_spp_prc': ('Скидка постоянного Покупателя (СПП), %', 22, 'float'),
+    'commission_percent': ('Размер кВВ, %', 23, 'float'),
+    'ppvz_kvw_prc_base': ('Размер кВВ без НДС, % Базовый', 24, 'float'),
+    'ppvz_kvw_prc': ('Итоговый кВВ без НДС, %', 25, 'float'),
+    'ppvz_sales_commission': ('Вознаграждение с продаж до вычета услуг поверенного, без НДС', 26, 'float'),
+    'ppvz_reward': ('Возмещение за выдачу и возврат товаров на ПВЗ', 27, 'float'),
+    'acquiring_fee': ('Эквайринг/Комиссии за организацию платежей', 28, 'float'),
+    'ppvz_vw': ('Вознаграждение Вайлдберриз (ВВ), без НДС', 31, 'float'),
+    'ppvz_vw_nds': ('НДС с Вознаграждения Вайлдберриз', 32, 'float'),
+    'ppvz_for_pay': ('К перечислению Продавцу за реализованный Товар', 33, 'float'),
+    'delivery_amount': ('Количество доставок', 34, 'int'),
+    'return_amount': ('Количество возврата', 35, 'int'),
+    'delivery_rub': ('Услуги по доставке товара покупателю', 36, 'float'),
+    'penalty': ('Общая сумма штрафов', 40, 'float'),
+    'additional_payment': ('Доплаты', 41, 'float'),
+    'bonus_type_name': ('Виды логистики, штрафов и доплат', 42, 'str_or_none'),
+    'sticker_id': ('Стикер МП', 43, 'str_or_zero'),
+    'acquiring_bank': ('Наименование банка-эквайера', 44, 'str'),
+    'ppvz_office_id': ('Номер офиса', 45, 'str_or_zero'),
+    'ppvz_office_name': ('Наименование офиса доставки', 46, 'str'),
+    'ppvz_inn': ('ИНН партнера', 47, 'str'),
+    'ppvz_supplier_name': ('Партнер', 48, 'str'),
+    'office_name': ('Склад', 49, 'str'),
+    'site_country': ('Страна', 50, 'str'),
+    'gi_box_type_name': ('Тип коробов', 51, 'str'),
+    'declaration_number': ('Номер таможенной декларации', 52, 'str'),
+    'kiz': ('Код маркировки', 54, 'str_or_none'),
+    'shk_id': ('ШК', 55, 'str'),
+    'posting_number': ('Srid', 56, 'str'),
+    'rebill_logistic_cost': ('Возмещение издержек по перевозке/по складским операциям с товаром', 57, 'float'),
+    'rebill_logistic_org': ('Организатор перевозки', 58, 'str_or_none'),
+    'storage_fee': ('Хранение', 59, 'float'),
+    'deduction': ('Удержания', 60, 'float'),
+    'acceptance': ('Платная приемка', 61, 'float'),
+}
+
+
+def normalize_header(header) -> str:
+    return re.sub(r'\s+', ' ', str(header)).strip().lower().replace('ё', 'е')
+
+
+def resolve_columns(columns: pd.Index) -> dict[str, object]:
+    """
+    Сопоставляет поля отчёта со столбцами DataFrame по заголовкам.
+
+    Если каких-то заголовков нет, а число столбцов совпадает со старым форматом отчёта,
+    столбцы берутся по позиции с предупреждением в логе. Иначе отчёт не разбирается.
+    """
+    headers = {}
+    for column in columns:
+        headers.setdefault(normalize_header(column), column)
+
+    resolved, missing = {}, []
+    for field, (header, _, _) in REPORT_COLUMNS_MAP.items():
+        column = headers.get(normalize_header(header))
+        if column is None:
+            missing.append(header)
+        resolved[field] = column
+
+    if not missing:
+        return resolved
+    if len(columns) == LEGACY_COLUMNS_COUNT:
+        logger.error(f"В отчёте не найдены столбцы {missing}, столбцы сопоставлены по позиции")
+        return {field: columns[position] for field, (_, position, _) in REPORT_COLUMNS_MAP.items()}
+    raise Exception(f"В отчёте не найдены столбцы {missing}")
+
+
+def round_money(values: np.ndarray) -> np.ndarray:
+    """
+    Округление до копеек, совпадающее со встроенным round(value, 2).
+
+    np.round умножает на 100 и может ошибиться на копейку у значений, близких к половине копейки,
+    такие значения пересчитываются через round.
+    """
+    rounded = np.round(values, 2)
+    halves = np.abs(np.abs(values * 100) % 1 - 0.5) < 1e-6
+    if halves.any():
+        rounded[halves] = [round(value, 2) for value in values[halves].tolist()]
+    return rounded
+
+
+def share_strings(values: np.ndarray) -> np.ndarray:
+    """Массив тех же строк, в котором одинаковые значения ссылаются на один объект."""
+    codes, uniques = pd.factorize(values)
+    # Пустым значениям factorize даёт код -1, он указывает на добавленный в конец None
+    return np.append(uniques.astype(object), None)[codes]
+
+
+def to_numbers(series: pd.Series) -> np.ndarray:
+    """Числа столбца. Пустые и нечисловые значения - ошибка, как float('') и int('x') при построчном разборе."""
+    values = pd.to_numeric(series, errors='raise').to_numpy(dtype=np.float64)
+    if np.isnan(values).any():
+        raise ValueError(f"Пустое значение в столбце {series.name}")
+    return values
+
+
+def convert_column(series: pd.Series, kind: str) -> np.ndarray:
+    if kind == 'str':
+        return share_strings(series.to_numpy(dtype=object))
+    if kind in ('str_or_none', 'str_or_zero'):
+        values = series.to_numpy(dtype=object, copy=True)
+        values[values == ''] = None if kind == 'str_or_none' else '0'
+        return share_strings(values)
+    if kind == 'int':
+        values = to_numbers(series)
+        if not (values == np.trunc(values)).all():
+            raise ValueError(f"Нецелое значение в столбце {series.name}")
+        return values.astype(np.int64)
+    if kind == 'float':
+        return round_money(to_numbers(series))
+    if kind == 'float_or_zero':
+        return round_money(to_numbers(series.replace('', '0')))
+    if kind == 'date':
+        return pd.to_datetime(series, format='ISO8601').to_numpy(dtype='datetime64[D]')
+    raise ValueError(f"Неизвестный тип столбца {kind}")
+
+
+def read_report_batch(excel_file: pd.ExcelFile, realizationreport_id: str, date: datetime.date) -> ReportBatch:
+    """Разбирает первый лист отчёта в ReportBatch, преобразуя столбцы целиком."""
+    sheet_name = excel_file.sheet_names[0]
+    df = pd.read_excel(excel_file, sheet_name=sheet_name, na_values=['', 'NaN'], dtype=str)
+    df = df.fillna('')
+
+    resolved = resolve_columns(df.columns)
+    columns = {field: convert_column(df[resolved[field]], kind) for field, (_, _, kind) in REPORT_COLUMNS_MAP.items()}
+
+    # Одинаковые для всех строк значения - представления одного элемента без копирования на каждую строку
+    size = len(df)
+    columns['realizationreport_id'] = np.broadcast_to(np.array(realizationreport_id, dtype=object), size)
+    columns['operation_date'] = np.broadcast_to(np.datetime64(date, 'D'), size)
+    columns['order_id'] = np.broadcast_to(np.array('0', dtype=object), size)
+    columns['ppvz_supplier_id'] = np.broadcast_to(np.array('0', dtype=object), size)
+    return ReportBatch(columns)
+
+
+@contextmanager
+def open_report_archive(zip_file_path: str) -> Iterator[pd.ExcelFile]:
+    """
+    Открывает отчёт из zip-архива без распаковки на диск.
+
+    Первый файл архива читается в память и передаётся в pd.ExcelFile.
+    """
+    with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
+        with zip_ref.open(zip_ref.namelist()[0]) as member:
+            data = io.BytesIO(member.read())
+
+    with pd.ExcelFile(data) as excel_file:
+        yield excel_file
+
+
+def read_report_archive(zip_file_path: str, realizationreport_id: str, date: datetime.date) -> ReportBatch:
+    """Разбирает отчёт из zip-архива."""
+    with open_report_archive(zip_file_path) as excel_file:
+        return read_report_batch(excel_file=excel_file, realizationreport_id=realizationreport_id, date=date)
@@ -0,0 +1,39 @@
+import datetime
+
+from log_api import logger
+
+REPORTS_DAILY_URL = 'https://seller.wildberries.ru/suppliers-mutual-settlements/reports-implementations/reports-daily'
+REPORTS_ROW_SELECTOR = '.Reports-table-row__Z2QO2UwUMF'
+REPORTS_NEXT_PAGE_SELECTOR = '[class*="Pagination"] button[class*="next"], [class*="Pagination"] [aria-label*="next" i]'
+REPORTS_PAGES = 3
+
+# Тексты всех span каждой строки таблицы отчётов за один вызов
+SCRAPE_ROWS_JS = """
+return Array.from(document.querySelectorAll(arguments[0]),
+                  row => Array.from(row.querySelectorAll('span'), span => (span.innerText || '').trim()));
+"""
+
+# Переход на следующую страницу таблицы. false, если кнопки нет или она неактивна
+NEXT_PAGE_JS = """
+const button = document.querySelector(arguments[0]);
+if (!button || button.disabled || button.getAttribute('aria-disabled') === 'true') {
+    return false;
+}
+button.click();
+return true;
+"""
+
+
+def parse_report_rows(rows: list[list[str]]) -> list[tuple[str, datetime.date]]:
+    """
+    Строки таблицы отчётов из SCRAPE_ROWS_JS: (id отчёта, дата формирования).
+
+    В строке первый span - номер отчёта, третий - дата формирования дд.мм.гггг.
+    """
+    reports = []
+    for spans in rows:
+        try:
+            reports.append((spans[0], datetime.datetime.strptime(spans[2], '%d.%m.%Y').date()))
+        except (ValueError, IndexError) as e:
+            logger.error(f"Ошибка при обработке элемента: {e}")
+    return reports
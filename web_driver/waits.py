@@ -0,0 +1,105 @@
+import time
+import random
+
+from typing import Callable, Optional
+from collections import defaultdict
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException
+
+TIME_AWAITED = 25
+TIME_JITTER = (0.5, 2.0)
+NETWORK_IDLE_TIME = 0.5
+POLL_FREQUENCY = 0.25
+
+# Счётчик незавершённых запросов страницы: fetch и XMLHttpRequest оборачиваются один раз на документ.
+# Записи resource timing появляются только после завершения запроса, поэтому незавершённые считаются здесь.
+NETWORK_TRACKER_JS = """
+if (window.__pendingRequests === undefined) {
+    window.__pendingRequests = 0;
+    const done = () => { window.__pendingRequests = Math.max(0, window.__pendingRequests - 1); };
+    if (window.fetch) {
+        const fetch = window.fetch;
+        window.fetch = function () {
+            window.__pendingRequests++;
+            return fetch.apply(this, arguments).finally(done);
+        };
+    }
+    const send = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function () {
+        window.__pendingRequests++;
+        this.addEventListener('loadend', done, {once: true});
+        return send.apply(this, arguments);
+    };
+}
+"""
+
+# Состояние загрузки, число загруженных ресурсов и незавершённых запросов в одном вызове.
+# Запросы, начатые до установки счётчика на странице, видны только по числу ресурсов.
+NETWORK_STATE_JS = NETWORK_TRACKER_JS + """
+performance.setResourceTimingBufferSize(10000);
+return [document.readyState, performance.getEntriesByType('resource').length, window.__pendingRequests];
+"""
+
+
+class WaitEngine:
+    """
+    Ожидания браузера по реальным признакам готовности страницы вместо фиксированных пауз.
+
+    - page_ready: document.readyState == "complete";
+    - network_idle: за idle секунд не появилось новых сетевых ресурсов и нет незавершённых fetch/XHR;
+    - until: произвольное условие WebDriverWait;
+    - jitter: короткая случайная пауза перед действиями пользователя в пределах TIME_JITTER.
+
+    Время всех ожиданий накапливается по шагам в stats.
+    """
+
+    def __init__(self, driver, timeout: float = TIME_AWAITED, jitter: tuple[float, float] = TIME_JITTER) -> None:
+        self.driver = driver
+        self.timeout = timeout
+        self.jitter_range = jitter
+        self.stats: dict[str, float] = defaultdict(float)
+
+    def _record(self, step: str, started: float) -> None:
+        self.stats[step] += time.perf_counter() - started
+
+    def until(self, condition: Callable, step: str, timeout: Optional[float] = None):
+        started = time.perf_counter()
+        try:
+            return WebDriverWait(self.driver, timeout or self.timeout, poll_frequency=POLL_FREQUENCY).until(condition)
+        finally:
+            self._record(step, started)
+
+    def page_ready(self, step: str, timeout: Optional[float] = None) -> None:
+        self.until(lambda driver: driver.execute_script("return document.readyState") == "complete",
+                   step=step, timeout=timeout)
+
+    def network_idle(self, step: str, idle: float = NETWORK_IDLE_TIME, timeout: Optional[float] = None) -> None:
+        """Ждёт, пока страница загрузится и сеть затихнет на idle секунд. По таймауту не падает."""
+        started = time.perf_counter()
+        deadline = started + (timeout or self.timeout)
+        last_count, idle_since = None, started
+        try:
+            while time.perf_counter() < deadline:
+                state, count, pending = self.driver.execute_script(NETWORK_STATE_JS)
+                now = time.perf_counter()
+                if state != "complete" or pending or count != last_count:
+                    last_count, idle_since = count, now
+                elif now - idle_since >= idle:
+                    return
+                time.sleep(POLL_FREQUENCY)
+        finally:
+            self._record(step, started)
+
+    def jitter(self, step: str) -> None:
+        started = time.perf_counter()
+        time.sleep(random.uniform(*self.jitter_range))
+        self._record(step, started)
+
+    def settle(self, step: str, timeout: Optional[float] = None) -> None:
+        """Загрузка страницы, затишье сети и пауза перед следующим действием."""
+        try:
+            self.page_ready(step=step, timeout=timeout)
+        except TimeoutException:
+            pass
+        self.network_idle(step=step, timeout=timeout)
+        self.jitter(step=step)
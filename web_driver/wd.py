@@ -1,21 +1,19 @@
 import os
 import time
 import random
-import shutil
-import zipfile
 import datetime
+import threading
 
 import pandas as pd
 import undetected_chromedriver as uc
 
-from typing import Type
+from typing import Type, Callable, Iterable, Iterator, Optional
 from functools import wraps
 from contextlib import suppress
 from seleniumwire import webdriver
 from sqlalchemy.exc import IntegrityError
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support.ui import WebDriverWait
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.support import expected_conditions
 from selenium.common.exceptions import InvalidSessionIdException, WebDriverException
@@ -23,15 +21,29 @@ from selenium.common.exceptions import NoSuchWindowException, TimeoutException,
 
 from database.models import Market
 from database.db import DbConnection
+from database.journal import ReportJournal
 from log_api import logger, get_moscow_time
-from database.data_classes import DataWBReportDaily
+from log_api.metrics import metrics, StageStats
+from database.data_classes import ReportBatch
+from .waits import WaitEngine, TIME_AWAITED, NETWORK_TRACKER_JS
+from .pipeline import ReportPipeline
+from .downloads import DownloadWatcher
+from .capture import CAPTURE_SCOPES, REPORTS_LIST_PATTERN, captured_json, report_details_pattern
+from .http_client import ReportHttpClient, parse_reports_payload
+from .report_cache import ReportCache
+from .report_table import (REPORTS_DAILY_URL, REPORTS_ROW_SELECTOR, REPORTS_NEXT_PAGE_SELECTOR, REPORTS_PAGES,
+                           SCRAPE_ROWS_JS, NEXT_PAGE_JS, parse_report_rows)
+from .report_reader import read_report_batch
 from .create_extension_proxy import create_proxy_auth_extension
 
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
+PROXY_PREWARM_URL = 'https://seller.wildberries.ru/'
+PHONE_MESSAGE_RETRY_SLEEP = (10, 15)
 
-TIME_AWAITED = 25
-TIME_SLEEP = (10, 15)
+
+def get_browser_id(market: Type[Market]) -> str:
+    return f"{market.connect_info.phone}_WB"
 
 
 def handle_exceptions(func):
@@ -53,13 +65,13 @@ def modal_exceptions(func):
         except ElementClickInterceptedException:
             logger.warning("Обнаружено модальное окно, закрываю его.")
             try:
-                cancel_button = WebDriverWait(self.driver, TIME_AWAITED).until(
+                cancel_button = self.waits.until(
                     expected_conditions.element_to_be_clickable((By.CSS_SELECTOR,
-                                                                 'button.zYbWaxtcLWbZ0k3fKPTi.llfYEylHL4V2OpZmoDqx'))
-                )
+                                                                 'button.zYbWaxtcLWbZ0k3fKPTi.llfYEylHL4V2OpZmoDqx')),
+                    step='modal')
 
                 cancel_button.click()
-                time.sleep(random.randint(*TIME_SLEEP))
+                self.waits.jitter('modal')
             except TimeoutException:
                 logger.error("Не удалось найти кнопку для закрытия модального окна.")
             return func(self, *args, **kwargs)
@@ -67,71 +79,113 @@ def modal_exceptions(func):
     return wrapper
 
 
+_chromedriver_path = None
+_chromedriver_lock = threading.Lock()
+
+
+def chromedriver_path() -> str:
+    """Путь к chromedriver, определяемый через ChromeDriverManager один раз на процесс."""
+    global _chromedriver_path
+    with _chromedriver_lock:
+        if _chromedriver_path is None:
+            _chromedriver_path = ChromeDriverManager().install()
+        return _chromedriver_path
+
+
+def launch_browser(browser_id: str, proxy: str) -> webdriver.Chrome:
+    """Запускает Chrome с профилем browser_id и расширением авторизации прокси."""
+    profile_path = os.path.join(os.getcwd(), "chrome_profile", browser_id)
+    reports_path = os.path.join(os.getcwd(), "reports")
+    os.makedirs(profile_path, exist_ok=True)
+    os.makedirs(reports_path, exist_ok=True)
+
+    chrome_options = uc.ChromeOptions()
+    chrome_options.add_argument("--lang=ru")
+    chrome_options.add_argument("--headless")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--log-level=3")
+    chrome_options.add_argument("--disable-automation")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument("--allow-insecure-localhost")
+    chrome_options.add_argument("--ignore-certificate-errors")
+    chrome_options.add_argument(f"--user-data-dir={profile_path}")
+    chrome_options.add_experimental_option("useAutomationExtension", False)
+    chrome_options.add_argument("--disable-blink-features=AutomationControlled")
+    chrome_options.add_experimental_option('excludeSwitches', ['enable-automation'])
+    chrome_options.add_experimental_option('prefs', {"download.default_directory": reports_path,
+                                                     "download.prompt_for_download": False})
+    chrome_options.add_argument("--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+                                "(KHTML, like Gecko) Chrome/119.0.5945.86 Safari/537.36")
+
+    service = Service(chromedriver_path())
+
+    proxy_auth_path = os.path.join(os.getcwd(), f"proxy_auth")
+    os.makedirs(proxy_auth_path, exist_ok=True)
+
+    ext_path = create_proxy_auth_extension(proxy_auth_path, proxy, prewarm_url=PROXY_PREWARM_URL)
+    chrome_options.add_argument(f'--load-extension={ext_path}')
+    driver = webdriver.Chrome(service=service, options=chrome_options)
+    driver.scopes = CAPTURE_SCOPES
+    # Счётчик незавершённых запросов для WaitEngine.network_idle ставится до скриптов каждой страницы
+    with suppress(WebDriverException):
+        driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': NETWORK_TRACKER_JS})
+
+    driver.maximize_window()
+    return driver
+
+
 class WebDriver:
-    def __init__(self, market: Type[Market], user: str, db_conn_admin: DbConnection, db_conn_arris: DbConnection):
+    def __init__(self, market: Type[Market], user: str, db_conn_admin: DbConnection, db_conn_arris: DbConnection,
+                 direct_download: bool = False, driver: Optional[webdriver.Chrome] = None,
+                 journal: Optional[ReportJournal] = None):
 
         self.user = user
-        self.market = market
-        self.new_path = None
-        self.client_id = market.client_id
+        self.http_client = None
+        self.direct_download = direct_download
+        self.journal = journal or ReportJournal()
+        self.report_cache = ReportCache()
         self.db_conn_admin = db_conn_admin
         self.db_conn_arris = db_conn_arris
         self.proxy = market.connect_info.proxy
         self.phone = market.connect_info.phone
-        self.browser_id = f"{market.connect_info.phone}_WB"
+        self.browser_id = get_browser_id(market)
         self.marketplace = self.db_conn_admin.get_marketplace()
-
-        self.profile_path = os.path.join(os.getcwd(), "chrome_profile", self.browser_id)
         self.reports_path = os.path.join(os.getcwd(), "reports")
-        os.makedirs(self.profile_path, exist_ok=True)
-        os.makedirs(self.reports_path, exist_ok=True)
-
-        self.chrome_options = uc.ChromeOptions()
-        self.chrome_options.add_argument("--lang=ru")
-        self.chrome_options.add_argument("--headless")
-        self.chrome_options.add_argument("--no-sandbox")
-        self.chrome_options.add_argument("--disable-gpu")
-        self.chrome_options.add_argument("--log-level=3")
-        self.chrome_options.add_argument("--disable-automation")
-        self.chrome_options.add_argument("--disable-dev-shm-usage")
-        self.chrome_options.add_argument("--allow-insecure-localhost")
-        self.chrome_options.add_argument("--ignore-certificate-errors")
-        self.chrome_options.add_argument(f"--user-data-dir={self.profile_path}")
-        self.chrome_options.add_experimental_option("useAutomationExtension", False)
-        self.chrome_options.add_argument("--disable-blink-features=AutomationControlled")
-        self.chrome_options.add_experimental_option('excludeSwitches', ['enable-automation'])
-        self.chrome_options.add_argument("--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-                                         "(KHTML, like Gecko) Chrome/119.0.5945.86 Safari/537.36")
-
-        self.service = Service(ChromeDriverManager().install())
-
-        self.proxy_auth_path = os.path.join(os.getcwd(), f"proxy_auth")
-        os.makedirs(self.proxy_auth_path, exist_ok=True)
-
-        ext_path = create_proxy_auth_extension(self.proxy_auth_path, self.proxy)
-        self.chrome_options.add_argument(f'--load-extension={ext_path}')
-        self.driver = webdriver.Chrome(service=self.service, options=self.chrome_options)
-
-        self.driver.maximize_window()
+
+        self.driver = driver or launch_browser(self.browser_id, self.proxy)
+        self.download_watcher = DownloadWatcher()
+        self.waits = WaitEngine(self.driver)
+        self.bind(market)
+
+    def bind(self, market: Type[Market]) -> None:
+        """Переключает браузер на кабинет market с тем же профилем (телефоном)."""
+        if get_browser_id(market) != self.browser_id:
+            raise ValueError(f"Кабинет {market.name_company} использует другой профиль браузера")
+        self.market = market
+        self.new_path = None
+        self.client_id = market.client_id
+        if self.http_client is not None:
+            self.http_client.close()
+            self.http_client = None
 
     def check_auth(self):
         try:
-            WebDriverWait(self.driver, TIME_AWAITED * 4).until(
-                lambda driver: driver.execute_script("return document.readyState") == "complete"
-            )
-            last_url = None
-            while True:
-                if last_url == self.driver.current_url:
-                    break
-                last_url = self.driver.current_url
-                WebDriverWait(self.driver, TIME_AWAITED * 4).until(
-                    lambda driver: driver.execute_script("return document.readyState") == "complete"
-                )
-                time.sleep(random.randint(*TIME_SLEEP))
+            with metrics.stage(self.client_id, 'check_auth'):
+                self.waits.page_ready('check_auth', timeout=TIME_AWAITED * 4)
+                last_url = None
+                while True:
+                    if last_url == self.driver.current_url:
+                        break
+                    last_url = self.driver.current_url
+                    self.waits.page_ready('check_auth', timeout=TIME_AWAITED * 4)
+                    self.waits.network_idle('check_auth')
+                    self.waits.jitter('check_auth')
 
             if self.marketplace.link in last_url:
                 logger.info(f"Автоматизация {self.market.name_company} запущена")
-                self.wb_auth(self.marketplace)
+                with metrics.stage(self.client_id, 'wb_auth'):
+                    self.wb_auth(self.marketplace)
             if self.marketplace.domain in last_url:
                 logger.info(f"Вход в ЛК {self.market.name_company} выполнен")
         except Exception as e:
@@ -142,17 +196,20 @@ class WebDriver:
 
         for _ in range(3):
             try:
-                time.sleep(random.randint(*TIME_SLEEP))
-                input_phone = WebDriverWait(self.driver, TIME_AWAITED * 4).until(
+                input_phone = self.waits.until(
                     expected_conditions.element_to_be_clickable((By.CSS_SELECTOR,
-                                                                 '.SimpleInput-JIIQvb037j')))
+                                                                 '.SimpleInput-JIIQvb037j')),
+                    step='wb_auth', timeout=TIME_AWAITED * 4)
+                self.waits.jitter('wb_auth')
                 input_phone.send_keys(self.phone)
-                time.sleep(random.randint(*TIME_SLEEP))
-                button_phone = WebDriverWait(self.driver, TIME_AWAITED * 4).until(
+                button_phone = self.waits.until(
                     expected_conditions.element_to_be_clickable((By.XPATH,
-                                                                 '//*[@data-testid="submit-phone-button"]')))
+                                                                 '//*[@data-testid="submit-phone-button"]')),
+                    step='wb_auth', timeout=TIME_AWAITED * 4)
+                self.waits.jitter('wb_auth')
                 break
             except TimeoutException:
+                metrics.add(self.client_id, 'wb_auth', StageStats(retries=1))
                 self.driver.refresh()
         else:
             raise Exception('Страница не получена')
@@ -175,21 +232,26 @@ class WebDriver:
                                                      time_request=time_request)
                 break
             except IntegrityError:
-                time.sleep(random.randint(*TIME_SLEEP))
+                metrics.add(self.client_id, 'wb_auth', StageStats(retries=1))
+                time.sleep(random.randint(*PHONE_MESSAGE_RETRY_SLEEP))
         else:
             raise Exception('Ошибка параллельных запросов')
 
-        mes = self.db_conn_admin.get_phone_message(user=self.user,
-                                                   phone=self.phone,
-                                                   marketplace=marketplace.marketplace)
+        wait_start = time.perf_counter()
+        with metrics.stage(self.client_id, 'phone_message') as record:
+            mes = self.db_conn_admin.get_phone_message(user=self.user,
+                                                       phone=self.phone,
+                                                       marketplace=marketplace.marketplace)
+            record.db_wait = time.perf_counter() - wait_start
 
         logger.info(f"Код на номер {self.phone} получен: {mes}")
         logger.info(f"Ввод кода {mes}")
 
         try:
-            time.sleep(random.randint(*TIME_SLEEP))
-            inputs_code = WebDriverWait(self.driver, TIME_AWAITED * 4).until(
-                expected_conditions.presence_of_all_elements_located((By.CSS_SELECTOR, '.InputCell-PB5beCCt55')))
+            inputs_code = self.waits.until(
+                expected_conditions.presence_of_all_elements_located((By.CSS_SELECTOR, '.InputCell-PB5beCCt55')),
+                step='wb_auth', timeout=TIME_AWAITED * 4)
+            self.waits.jitter('wb_auth')
 
             if len(mes) == len(inputs_code):
                 for i, input_code in enumerate(inputs_code):
@@ -200,11 +262,10 @@ class WebDriver:
             raise Exception('Отсутствует поле ввода кода')
 
         logger.info(f"Вход в ЛК {marketplace.marketplace} {self.market.name_company}")
-        for _ in range(10):
-            if marketplace.domain in self.driver.current_url:
-                logger.info(f"Вход в ЛК {marketplace.marketplace} {self.market.name_company} выполнен")
-                return
-            time.sleep(random.randint(*TIME_SLEEP))
+        with suppress(TimeoutException):
+            self.waits.until(lambda driver: marketplace.domain in driver.current_url,
+                             step='wb_auth', timeout=TIME_AWAITED * 5)
+            logger.info(f"Вход в ЛК {marketplace.marketplace} {self.market.name_company} выполнен")
 
     def is_browser_active(self):
         try:
@@ -221,7 +282,8 @@ class WebDriver:
             self.quit(f"{self.market.name_company} {self.market.entrepreneur} не обнаружен в client_id")
         else:
             logger.info(f"Авторизация {self.market.name_company}")
-            self.driver.get(url)
+            with metrics.stage(self.client_id, 'load_url'):
+                self.driver.get(url)
             self.check_auth()
 
     def quit(self, text: str = None):
@@ -229,213 +291,289 @@ class WebDriver:
             logger.error(f"{text}")
         else:
             logger.info(f"Браузер для {self.market.name_company} закрыт")
+        if self.waits.stats:
+            logger.info(f"Ожидания {self.market.name_company}: " +
+                        ", ".join(f"{step} {seconds:.1f} c" for step, seconds in self.waits.stats.items()))
+        if self.http_client is not None:
+            self.http_client.close()
+        self.download_watcher.stop()
         self.driver.quit()
 
     @modal_exceptions
     def stores_report_daily(self) -> None:
         """Собирает список отчётов."""
         logger.info(f"Сбор доступных отчётов {self.market.name_company}.")
-        reports = {}
-        for _ in range(5):
-            self.driver.get(
-                'https://seller.wildberries.ru/suppliers-mutual-settlements/reports-implementations/reports-daily')
-            time.sleep(random.randint(*TIME_SLEEP))
-            self.driver.refresh()
-            time.sleep(random.randint(*TIME_SLEEP))
-            try:
-                elements = WebDriverWait(self.driver, TIME_AWAITED).until(
-                    expected_conditions.presence_of_all_elements_located((By.CSS_SELECTOR,
-                                                                          '.Reports-table-row__Z2QO2UwUMF'))
-                )
-                break
-            except TimeoutException:
-                continue
-        else:
+        with metrics.stage(self.client_id, 'list_reports') as record:
+            reports = None
+            if self.direct_download:
+                reports = self.list_reports_direct()
+            if reports is None:
+                reports = self.list_reports_captured()
+            if reports is None:
+                reports = self.list_reports_page()
+            record.rows = sum(map(len, reports.values())) if reports else 0
+        if reports is None:
             logger.info(f"Нет отчётов {self.market.name_company}.")
             return
 
-        for element in elements:
-            try:
-                date_create = datetime.datetime.strptime(
-                    element.find_elements(By.TAG_NAME, 'span')[2].text, '%d.%m.%Y').date()
-                id_report = element.find_elements(By.TAG_NAME, 'span')[0].text
-                if id_report not in self.db_conn_arris.get_reports_id(client_id=self.client_id):
-                    reports.setdefault(date_create, [])
-                    reports[date_create].append(id_report)
-            except (ValueError, IndexError) as e:
-                logger.error(f"Ошибка при обработке элемента: {e}")
-                continue
+        if not reports:
+            logger.info(f"Нет новых отчётов {self.market.name_company}.")
+            return
 
-        if reports:
+        with ReportPipeline(load=self.load_report_archive) as pipeline:
             for date, reports_ids in reports.items():
                 self.change_path_downloads(date=date.isoformat())
+                to_download = []
                 for report_id in reports_ids:
-                    for retry in range(1, 4):
-                        if retry != 1:
-                            logger.info(f"Повторяем. Осталось {3 - retry} попыток")
-                        try:
-                            self.driver.get(
-                                f'https://seller.wildberries.ru/suppliers-mutual-settlements/reports-implementations/'
-                                f'reports-daily/report/{report_id}?isGlobalBalance=false')
-                            time.sleep(random.randint(*TIME_SLEEP))
-                            self.download_report_daily(report_id)
-                            break
-                        except Exception as e:
-                            logger.error(f"{e}")
-                            continue
+                    self.journal.listed(self.client_id, report_id, date)
+                    file_path = self.journal.is_downloaded(self.client_id, report_id)
+                    if file_path:
+                        pipeline.submit(file_path, date)
                     else:
-                        logger.error(f"Попытки исчерпаны отчёт {report_id} скачать не удалось")
-                self.save_data_in_database(date=date)
-        else:
-            logger.info(f"Нет новых отчётов {self.market.name_company}.")
+                        to_download.append(report_id)
+
+                if self.http_client is not None:
+                    with metrics.stage(self.client_id, 'download_api') as record:
+                        downloaded = self.http_client.download_reports(to_download, self.new_path)
+                        record.rows = len(downloaded)
+                        record.bytes = sum(map(os.path.getsize, downloaded.values()))
+                    for report_id, file_path in downloaded.items():
+                        self.journal.downloaded(self.client_id, report_id, date, file_path)
+                        pipeline.submit(file_path, date)
+                    to_download = [report_id for report_id in to_download if report_id not in downloaded]
+
+                for report_id in to_download:
+                    file_path = self.download_report_browser(report_id, date)
+                    if file_path:
+                        pipeline.submit(file_path, date)
+
+    def download_report_browser(self, report_id: str, date: datetime.date) -> Optional[str]:
+        """
+        Скачивает отчёт через страницу отчёта в папку change_path_downloads. Возвращает путь к архиву.
+
+        Делает до трёх попыток, после неудачных возвращает None и отмечает ошибку в журнале.
+        """
+        for retry in range(1, 4):
+            if retry != 1:
+                metrics.add(self.client_id, 'download', StageStats(retries=1))
+                logger.info(f"Повторяем. Осталось {3 - retry} попыток")
+            try:
+                del self.driver.requests
+                self.driver.get(
+                    f'https://seller.wildberries.ru/suppliers-mutual-settlements/reports-implementations/'
+                    f'reports-daily/report/{report_id}?isGlobalBalance=false')
+                if self.wait_captured(report_details_pattern(report_id), step='download'):
+                    self.waits.jitter('download')
+                else:
+                    self.waits.settle('download')
+                with metrics.stage(self.client_id, 'download') as record:
+                    file_path = self.download_report_daily(report_id)
+                    record.rows = 1
+                    record.bytes = os.path.getsize(file_path)
+                self.journal.downloaded(self.client_id, report_id, date, file_path)
+                return file_path
+            except Exception as e:
+                logger.error(f"{e}")
+                continue
+        logger.error(f"Попытки исчерпаны отчёт {report_id} скачать не удалось")
+        self.journal.failed(self.client_id, report_id, "Попытки скачивания исчерпаны")
+        return None
 
-    @modal_exceptions
-    def download_report_daily(self, report: str) -> None:
-        """Скачивание ежедневного отчёта."""
-        download_folder = os.path.expanduser("~/Downloads")
+    def list_reports_direct(self) -> Optional[dict[datetime.date, list[str]]]:
+        """Новые отчёты, сгруппированные по дате, из API ЛК. None, если API недоступно."""
+        try:
+            self.http_client = ReportHttpClient.from_driver(self.driver, self.proxy)
+            listed = self.http_client.list_reports()
+        except Exception as e:
+            logger.error(f"Список отчётов {self.market.name_company} через API не получен: {e}")
+            if self.http_client is not None:
+                self.http_client.close()
+                self.http_client = None
+            return None
+
+        return self.new_reports(listed)
+
+    def list_reports_page(self) -> Optional[dict[datetime.date, list[str]]]:
+        """
+        Новые отчёты, сгруппированные по дате, со страницы reports-daily. None, если таблица не найдена.
+
+        Строки таблицы читаются одним execute_script на страницу, следующие страницы - до REPORTS_PAGES.
+        """
+        if not self.open_reports_page():
+            return None
+
+        listed = {}
+        for page_reports in self.iter_report_pages(REPORTS_PAGES):
+            listed.update(page_reports)
+        return self.new_reports(listed.items())
+
+    def open_reports_page(self) -> bool:
+        """Открывает страницу reports-daily и ждёт таблицу отчётов. False, если таблица так и не появилась."""
+        for _ in range(5):
+            self.driver.get(REPORTS_DAILY_URL)
+            self.waits.settle('list_reports')
+            self.driver.refresh()
+            self.waits.settle('list_reports')
+            try:
+                self.waits.until(
+                    expected_conditions.presence_of_all_elements_located((By.CSS_SELECTOR, REPORTS_ROW_SELECTOR)),
+                    step='list_reports')
+                return True
+            except TimeoutException:
+                continue
+        return False
+
+    def iter_report_pages(self, pages: Optional[int] = None,
+                          throttle: Optional[Callable[[], None]] = None) -> Iterator[list[tuple[str, datetime.date]]]:
+        """
+        Страницы открытой таблицы отчётов: (id отчёта, дата формирования), от новых к старым.
+
+        pages=None - до последней страницы. throttle вызывается перед переходом на каждую следующую страницу.
+        """
+        page = 0
+        while True:
+            rows = self.driver.execute_script(SCRAPE_ROWS_JS, REPORTS_ROW_SELECTOR)
+            yield parse_report_rows(rows)
+            page += 1
+            if pages is not None and page >= pages:
+                return
+            if throttle is not None:
+                throttle()
+            if not self.driver.execute_script(NEXT_PAGE_JS, REPORTS_NEXT_PAGE_SELECTOR):
+                return
+            try:
+                self.waits.until(lambda driver: driver.execute_script(SCRAPE_ROWS_JS, REPORTS_ROW_SELECTOR) != rows,
+                                 step='list_reports')
+            except TimeoutException:
+                logger.error(f"Следующая страница отчётов {self.market.name_company} не загрузилась")
+                return
 
+    def list_reports_captured(self) -> Optional[dict[datetime.date, list[str]]]:
+        """
+        Новые отчёты, сгруппированные по дате, из ответа API, которым страница reports-daily загружает таблицу.
+
+        Ответ берётся из запросов браузера, перехваченных seleniumwire. None, если ответ не перехвачен
+        или в нём не нашлось ни одного отчёта (например, изменился формат ответа), - тогда таблица читается со страницы.
+        """
+        del self.driver.requests
+        self.driver.get(REPORTS_DAILY_URL)
+        if not self.wait_captured(REPORTS_LIST_PATTERN, step='list_reports'):
+            return None
+        self.waits.network_idle('list_reports')
+
+        listed = {}
+        for _, payload in captured_json(self.driver, REPORTS_LIST_PATTERN):
+            listed.update(parse_reports_payload(payload))
+        if not listed:
+            logger.error(f"В перехваченном ответе API нет отчётов {self.market.name_company}, список читается со страницы")
+            return None
+        return self.new_reports(listed.items())
+
+    def new_reports(self, listed: Iterable[tuple[str, datetime.date]]) -> dict[datetime.date, list[str]]:
+        """Отчёты из listed, которых ещё нет в базе, сгруппированные по дате."""
+        reports = {}
+        reports_id = self.db_conn_arris.get_reports_id(client_id=self.client_id)
+        for id_report, date_create in listed:
+            if id_report not in reports_id:
+                reports.setdefault(date_create, [])
+                reports[date_create].append(id_report)
+        return reports
+
+    def wait_captured(self, pattern: str, step: str) -> bool:
+        """Ждёт перехваченный JSON-ответ на запрос, URL которого соответствует pattern."""
+        try:
+            return self.waits.until(lambda driver: next(captured_json(driver, pattern), None) is not None, step=step)
+        except TimeoutException:
+            return False
+
+    @modal_exceptions
+    def download_report_daily(self, report: str) -> str:
+        """Скачивание ежедневного отчёта. Возвращает путь к скачанному архиву."""
         download_wait_time = 120
+        self.download_watcher.expect()
 
         for retry in range(6):
             try:
+                if retry > 1:
+                    metrics.add(self.client_id, 'download', StageStats(retries=1))
                 if retry == 0:
                     raise TimeoutException
-                confirm_button = WebDriverWait(self.driver, TIME_AWAITED).until(
+                confirm_button = self.waits.until(
                     expected_conditions.element_to_be_clickable((By.CSS_SELECTOR,
-                                                                 '.Menu-block-item__button__VDTa2I8Ag7'))
-                )
+                                                                 '.Menu-block-item__button__VDTa2I8Ag7')),
+                    step='download')
                 confirm_button.click()
             except TimeoutException:
                 with suppress(TimeoutException):
-                    download_button = WebDriverWait(self.driver, TIME_AWAITED).until(
+                    download_button = self.waits.until(
                         expected_conditions.element_to_be_clickable((By.CSS_SELECTOR,
-                                                                     '.DownloadButtons__download-button__9EZ4rCwH8c'))
-                    )
+                                                                     '.DownloadButtons__download-button__9EZ4rCwH8c')),
+                        step='download')
                     download_button.click()
-                    time.sleep(random.randint(*TIME_SLEEP))
+                    self.waits.jitter('download')
                 continue
             else:
                 logger.info(f"Загрузка файла {self.new_path}\\{report} начата.")
-                time.sleep(random.randint(*TIME_SLEEP))
-                start_time = time.time()
-
-                while True:
-                    downloaded_files = [f for f in os.listdir(download_folder) if
-                                        f.endswith(".zip") and report in f and not f.endswith(".crdownload")]
-
-                    if downloaded_files:
-                        for file_name in downloaded_files:
-                            source_path = os.path.join(download_folder, file_name)
-                            destination_path = os.path.join(self.new_path, file_name)
-
-                            shutil.move(source_path, destination_path)
-                        logger.info(f"Загрузка файла {self.new_path}\\{report} завершена.")
-                        return
-                    elif time.time() - start_time > download_wait_time:
-                        logger.error(f"Загрузка файла {self.new_path}\\{report} превысила допустимое время.")
-                        break
-                    time.sleep(1)
+                file_path = self.download_watcher.wait(report, timeout=download_wait_time)
+                if file_path:
+                    logger.info(f"Загрузка файла {self.new_path}\\{report} завершена.")
+                    return file_path
+                logger.error(f"Загрузка файла {self.new_path}\\{report} превысила допустимое время.")
+                break
 
         raise Exception(f"Загрузка файла {self.new_path}\\{report} не удалась.")
 
     def change_path_downloads(self, date: str) -> None:
         """Устанавливанет место скачивания файла."""
-        self.new_path = f'{self.reports_path}\\{date}\\{self.client_id}'
+        self.new_path = os.path.join(self.reports_path, date, self.client_id)
 
         if not os.path.exists(self.new_path):
             os.makedirs(self.new_path)
 
+        self.driver.execute_cdp_cmd('Browser.setDownloadBehavior', {'behavior': 'allow',
+                                                                    'downloadPath': self.new_path})
+        self.download_watcher.watch(self.new_path)
+
     @staticmethod
-    def excel_to_entry(excel_file: pd.ExcelFile, realizationreport_id: str,
-                       date: datetime.date) -> list[DataWBReportDaily]:
-        sheet_name = excel_file.sheet_names[0]
-        df = pd.read_excel(excel_file, sheet_name=sheet_name, na_values=['', 'NaN'], dtype=str)
-        df = df.fillna('')
-
-        entry = []
-
-        rows_as_list = df.values
-
-        for row in rows_as_list:
-            entry.append(DataWBReportDaily(realizationreport_id=realizationreport_id,
-                                           gi_id=row[1],
-                                           subject_name=row[2],
-                                           sku=row[3],
-                                           brand=row[4],
-                                           vendor_code=row[5],
-                                           size=row[7],
-                                           barcode=row[8],
-                                           doc_type_name=row[9],
-                                           quantity=int(row[13]),
-                                           retail_price=round(float(row[14]), 2),
-                                           retail_amount=round(float(row[15]), 2),
-                                           sale_percent=int(row[18]),
-                                           commission_percent=round(float(row[23]), 2),
-                                           office_name=row[49],
-                                           supplier_oper_name=row[10],
-                                           order_date=datetime.datetime.strptime(row[11], "%Y-%m-%d").date(),
-                                           sale_date=datetime.datetime.strptime(row[12], "%Y-%m-%d").date(),
-                                           operation_date=date,
-                                           shk_id=row[55],
-                                           retail_price_withdisc_rub=round(float(row[19]), 2),
-                                           delivery_amount=int(row[34]),
-                                           return_amount=int(row[35]),
-                                           delivery_rub=round(float(row[36]), 2),
-                                           gi_box_type_name=row[51],
-                                           product_discount_for_report=round(float(row[16]), 2),
-                                           supplier_promo=round(float(row[17]), 2) if row[17] else 0,
-                                           order_id='0',
-                                           ppvz_spp_prc=round(float(row[22]), 2),
-                                           ppvz_kvw_prc_base=round(float(row[24]), 2),
-                                           ppvz_kvw_prc=round(float(row[25]), 2),
-                                           sup_rating_prc_up=round(float(row[20]), 2),
-                                           is_kgvp_v2=round(float(row[21]), 2),
-                                           ppvz_sales_commission=round(float(row[26]), 2),
-                                           ppvz_for_pay=round(float(row[33]), 2),
-                                           ppvz_reward=round(float(row[27]), 2),
-                                           acquiring_fee=round(float(row[28]), 2),
-                                           acquiring_bank=row[44],
-                                           ppvz_vw=round(float(row[31]), 2),
-                                           ppvz_vw_nds=round(float(row[32]), 2),
-                                           ppvz_office_id=row[45] or '0',
-                                           ppvz_office_name=row[46],
-                                           ppvz_supplier_id='0',
-                                           ppvz_supplier_name=row[48],
-                                           ppvz_inn=row[47],
-                                           declaration_number=row[52],
-                                           bonus_type_name=row[42] or None,
-                                           sticker_id=row[43] or '0',
-                                           site_country=row[50],
-                                           penalty=round(float(row[40]), 2),
-                                           additional_payment=round(float(row[41]), 2),
-                                           rebill_logistic_cost=round(float(row[57]), 2),
-                                           rebill_logistic_org=row[58] or None,
-                                           kiz=row[54] or None,
-                                           storage_fee=round(float(row[59]), 2),
-                                           deduction=round(float(row[60]), 2),
-                                           acceptance=round(float(row[61]), 2),
-                                           posting_number=row[56]))
-        return entry
+    def excel_to_entry(excel_file: pd.ExcelFile, realizationreport_id: str, date: datetime.date) -> ReportBatch:
+        return read_report_batch(excel_file=excel_file, realizationreport_id=realizationreport_id, date=date)
 
     def save_data_in_database(self, date: datetime.date):
+        """Загружает в базу все архивы из папки отчётов за дату date."""
         for zip_file in filter(lambda x: x.endswith('.zip'), os.listdir(self.new_path)):
-            zip_file_path = os.path.join(self.new_path, zip_file)
-
-            with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
-                file = zip_ref.namelist()[0]
-                zip_ref.extract(file, self.new_path)
+            self.load_report_archive(os.path.join(self.new_path, zip_file), date)
 
-                excel_file_path = os.path.join(self.new_path, file)
+    def load_report_archive(self, zip_file_path: str, date: datetime.date, force: bool = False) -> None:
+        """
+        Разбирает архив отчёта и загружает его в базу, если этот архив ещё не загружен (или force=True).
 
-                with pd.ExcelFile(excel_file_path) as excel_file:
-                    realizationreport_id = zip_file.split('.')[0].split('№')[-1]
-                    entry = self.excel_to_entry(excel_file=excel_file,
-                                                realizationreport_id=realizationreport_id,
-                                                date=date)
+        Разобранный отчёт берётся из кэша Parquet, если тот же архив уже разбирался.
+        """
+        client_id = self.client_id
+        realizationreport_id = os.path.basename(zip_file_path).split('.')[0].split('№')[-1]
 
-                os.remove(excel_file_path)
+        if not force and self.journal.is_loaded(client_id, realizationreport_id, zip_file_path):
+            return
+        downloaded = self.journal.is_downloaded(client_id, realizationreport_id)
+        if downloaded is None or os.path.abspath(downloaded) != os.path.abspath(zip_file_path):
+            self.journal.downloaded(client_id, realizationreport_id, date, zip_file_path)
 
-                self.db_conn_arris.add_wb_report_daily_entry(client_id=self.client_id,
+        try:
+            with metrics.stage(client_id, 'parse') as record:
+                entry = self.report_cache.load(zip_file_path=zip_file_path,
+                                               realizationreport_id=realizationreport_id,
+                                               date=date)
+                record.rows = len(entry)
+                record.bytes = os.path.getsize(zip_file_path)
+            self.journal.parsed(client_id, realizationreport_id, len(entry))
+
+            with metrics.stage(client_id, 'db_load') as record:
+                self.db_conn_arris.add_wb_report_daily_entry(client_id=client_id,
                                                              list_report=entry,
                                                              date=date,
                                                              realizationreport_id=realizationreport_id)
+                record.rows = len(entry)
+            self.journal.loaded(client_id, realizationreport_id, len(entry))
+        except Exception as e:
+            self.journal.failed(client_id, realizationreport_id, str(e))
+            raise